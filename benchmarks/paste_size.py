@@ -0,0 +1,56 @@
+""" page size of highlighted pastes over a corpus of files: the full page, the compact page
+    with the minified stylesheet embedded and the compact page which links to the shared
+    stylesheet's key. The lexer of a file is chosen by its name. The corpus defaults to this
+    repository's source and text files.
+
+    python benchmarks/paste_size.py [DIRECTORY ...] """
+
+import sys, os, os.path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from warren.core.PasteRenderer import PasteRenderer
+
+MAX_FILE_SIZE = 1024*1024
+# as long as a real key, so the link is as long as it will be
+STYLESHEET = 'CHK@' + 'x'*43 + ',' + 'x'*43 + ',AAMC--8/pastebin.css'
+
+def corpus(directories):
+    """ (name, text) of the files pygments has a lexer for """
+    from pygments.lexers import get_lexer_for_filename
+    from pygments.util import ClassNotFound
+    for directory in directories:
+        for path, dirs, files in os.walk(directory):
+            dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+            for name in sorted(files):
+                filename = os.path.join(path, name)
+                if os.path.getsize(filename) > MAX_FILE_SIZE:
+                    continue
+                try:
+                    text = open(filename, 'rb').read().decode('utf-8')
+                    lexer = get_lexer_for_filename(name).aliases[0]
+                except (UnicodeDecodeError, ClassNotFound), e:
+                    continue
+                yield filename, text, lexer
+
+def main(args):
+    directories = args or [ROOT]
+    renderer = PasteRenderer()
+    totals = [0, 0, 0, 0]
+    print '%-50s %10s %10s %10s %10s' % ('file', 'text', 'full', 'compact', 'linked')
+    for filename, text, lexer in corpus(directories):
+        sizes = [len(text.encode('utf-8')),
+                 len(renderer.renderPage(text, lexer, title=u'paste')),
+                 len(renderer.renderPage(text, lexer, title=u'paste', compact=True)),
+                 len(renderer.renderPage(text, lexer, title=u'paste', compact=True, stylesheet=STYLESHEET))]
+        totals = [total + size for total, size in zip(totals, sizes)]
+        print '%-50s %10d %10d %10d %10d' % ((os.path.relpath(filename)[-50:],) + tuple(sizes))
+    print '%-50s %10d %10d %10d %10d' % (('total',) + tuple(totals))
+    if totals[1]:
+        print 'compact saves %.1f %%, with the linked stylesheet %.1f %% of the full pages' % (
+            100.0 * (totals[1] - totals[2]) / totals[1], 100.0 * (totals[1] - totals[3]) / totals[1])
+    renderer.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,54 @@
+""" render time per MB of PasteRenderer.renderTo, for pastes of growing size. The paste is
+    warren's own python source repeated, highlighted in the calling thread and with large
+    chunks in the worker process, with and without line numbers.
+
+    python benchmarks/render.py [SIZE_MB ...] """
+
+import sys, os, os.path, time, glob
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from warren.core.PasteRenderer import PasteRenderer, CHUNK_SIZE, textChunks, lineCount
+
+SIZES = [1, 4, 16] # MiB
+
+class NullOut(object):
+    """ counts the bytes, the page isn't kept """
+    def __init__(self):
+        self.size = 0
+    def write(self, data):
+        self.size += len(data)
+
+def paste(size):
+    source = u''.join(open(name).read().decode('utf-8') for name in sorted(glob.glob(os.path.join(ROOT, 'warren', 'core', '*.py'))))
+    return (source * (size*1024*1024 / len(source) + 1))[:size*1024*1024]
+
+def render(renderer, text, linenos):
+    out = NullOut()
+    started = time.time()
+    renderer.renderTo(out, textChunks(text), 'python', lineCount(text), linenos, title=u'bench')
+    return time.time() - started, out.size
+
+def main(args):
+    sizes = [int(arg) for arg in args] or SIZES
+    renderers = [('in thread', PasteRenderer(workerMinSize=sys.maxint)), ('worker', PasteRenderer())]
+    for name, renderer in renderers:
+        renderer.css()
+        renderer.lexer('python')
+    renderers[1][1].renderPage(u'x = 1\n' * CHUNK_SIZE, 'python') # starts the worker
+    print '%8s %-10s %8s %12s %10s %10s' % ('size', 'renderer', 'linenos', 'time', 's / MiB', 'page')
+    try:
+        for size in sizes:
+            text = paste(size)
+            for name, renderer in renderers:
+                for linenos in (False, True):
+                    seconds, pageSize = render(renderer, text, linenos)
+                    print '%5d MiB %-10s %8s %10.2f s %10.3f %6.1f MiB' % (size, name, linenos, seconds, seconds / size,
+                                                                          pageSize / 1048576.0)
+    finally:
+        for name, renderer in renderers:
+            renderer.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,106 @@
+""" startup time of warren, each run in a fresh process with an empty settings directory.
+
+    cli:  from the start of the process until the node is connected, the node is the FCP
+          stand-in server from tests/, started once by this script
+    ui:   from the start of the process until WarrenUI's event loop runs, needs PyQt4 and
+          a display
+    The import times of the modules which are loaded when they are first used are listed
+    for comparison.
+
+    python benchmarks/startup.py [RUNS] """
+
+import time
+started = time.time()
+
+import sys, os, os.path, subprocess, tempfile, shutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+
+RUNS = 5
+DEFERRED = ['pygments.lexers, pygments.formatters', 'zipfile, multiprocessing', 'BaseHTTPServer']
+
+def cli(port):
+    from warren.core.Config import Config
+    from warren.cli import CliEngine
+    config = Config()
+    config['node']['fcp_port'] = int(port)
+    engine = CliEngine(config, sys.stdout)
+    engine.startWatchdog()
+    if not engine.waitConnected(30):
+        raise SystemExit('not connected')
+    seconds = time.time() - started
+    engine.stop()
+    return seconds
+
+def ui():
+    from PyQt4.QtGui import QApplication
+    from PyQt4.QtCore import QTimer
+    from warren.ui.MainWindow import MainWindow
+    app = QApplication(sys.argv)
+    window = MainWindow()
+    window.show()
+    result = []
+    def running():
+        result.append(time.time() - started)
+        app.quit()
+    QTimer.singleShot(0, running)
+    app.exec_()
+    return result[0]
+
+def deferred(modules):
+    exec 'import ' + modules
+    return time.time() - started
+
+def child(mode, arg):
+    if mode == 'cli':
+        return cli(arg)
+    if mode == 'ui':
+        return ui()
+    return deferred(arg)
+
+def run(mode, arg=''):
+    """ median seconds of the runs, None if the mode can't run here """
+    times = []
+    for i in range(RUNS):
+        home = tempfile.mkdtemp(prefix='warren-bench-')
+        env = dict(os.environ, HOME=home)
+        try:
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', mode, arg],
+                                       env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output, errors = process.communicate()
+        finally:
+            shutil.rmtree(home, ignore_errors=True)
+        if process.returncode != 0:
+            return None, errors.strip().splitlines()[-1:]
+        times.append(float(output.split()[-1]))
+    return sorted(times)[len(times) / 2], None
+
+def main(args):
+    global RUNS
+    if args[:1] == ['--child']:
+        print '%f' % child(args[1], args[2])
+        return
+    if args:
+        RUNS = int(args[0])
+    base, errors = run('deferred', 'sys')
+    print 'median of %d runs, python itself takes %.3f s' % (RUNS, base)
+    from fcpserver import FakeNode
+    node = FakeNode()
+    for mode, arg in (('cli', str(node.port)), ('ui', '')):
+        seconds, errors = run(mode, arg)
+        if seconds is None:
+            print '%-40s skipped: %s' % (mode, ''.join(errors))
+        else:
+            print '%-40s %.3f s' % (mode, seconds)
+    node.close()
+    print 'imported when first used:'
+    for modules in DEFERRED:
+        seconds, errors = run('deferred', modules)
+        if seconds is None:
+            print '  %-38s skipped: %s' % (modules, ''.join(errors))
+        else:
+            print '  %-38s %.3f s' % (modules, seconds - base)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,61 @@
+""" peak memory of a direct file upload by file size.
+
+    Each size is uploaded in a fresh process to the FCP stand-in server from tests/,
+    which drops the data, through FileManager's path for local files (openPayload ->
+    StreamPayload). For comparison the same file is also read into memory as a whole,
+    as uploads did before they were streamed.
+
+    python benchmarks/upload_memory.py [SIZE_MB ...] """
+
+import sys, os, os.path, subprocess, tempfile, resource, time, urllib, urllib2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+
+SIZES = [1, 16, 64, 256] # MiB
+
+def upload(size, mode):
+    """ runs in the child process, returns (seconds, peak rss in MiB) """
+    from fcpserver import FakeNode
+    from warren.core.FCPClient import FCPClient
+    from warren.core.Streaming import openPayload
+
+    fd, path = tempfile.mkstemp(prefix='warren-bench-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            block = os.urandom(1024*1024)
+            for i in range(size):
+                f.write(block)
+        node = FakeNode(keepData=False)
+        client = FCPClient('bench', port=node.port)
+        started = time.time()
+        if mode == 'stream':
+            data = openPayload(urllib2.build_opener(), 'file://' + urllib.pathname2url(path))
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+        client.put(data=data, name='bench', async=False, timeout=600)
+        seconds = time.time() - started
+        client.shutdown()
+        node.close()
+    finally:
+        os.remove(path)
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 # linux: KiB
+
+def main(args):
+    if args[:1] == ['--child']:
+        seconds, rss = upload(int(args[1]), args[2])
+        print '%f %f' % (seconds, rss)
+        return
+    sizes = [int(arg) for arg in args] or SIZES
+    print '%8s %18s %18s' % ('size', 'streamed', 'in memory')
+    for size in sizes:
+        results = []
+        for mode in ('stream', 'memory'):
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', str(size), mode])
+            seconds, rss = [float(value) for value in output.split()]
+            results.append('%6.1f MiB %6.2f s' % (rss, seconds))
+        print '%5d MiB %s %s' % (size, results[0], results[1])
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -11,5 +11,6 @@ setup(name = "warren",
     packages = ['warren','warren.ui','warren.core'],
     package_data = {'warren' : files },
     scripts = ["WarrenUI"],
+    entry_points = {"console_scripts" : ["warren = warren.cli:main"]},
     install_requires = ['configobj>=4.7.2', 'Pygments>=1.4'],
 ) 
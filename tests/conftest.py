@@ -0,0 +1,19 @@
+import sys, os.path
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fcpserver import FakeNode
+
+@pytest.fixture
+def node():
+    fakeNode = FakeNode()
+    yield fakeNode
+    fakeNode.close()
+
+@pytest.fixture
+def client(node):
+    from warren.core.FCPClient import FCPClient
+    fcpClient = FCPClient('test', port=node.port)
+    yield fcpClient
+    fcpClient.shutdown()
@@ -0,0 +1,221 @@
+""" FCP stand-in server for the tests. It listens on a free local port, answers
+    ClientHello with NodeHello and every other message with the scripted answers
+    of its handlers, which can be replaced per test """
+
+import socket, threading, hashlib, os, os.path
+
+def readMessage(reader, keepData=True):
+    """ one message as a dict with 'header', None if the connection is closed. Without
+        keepData the payload is read in chunks and dropped, 'Data' is its sha1 then """
+    message = {}
+    while True:
+        line = reader.readline()
+        if not line:
+            return None
+        line = line.rstrip('\r\n')
+        if not message:
+            if line:
+                message['header'] = line
+            continue
+        if line == 'EndMessage':
+            return message
+        if line == 'Data':
+            length = int(message.get('DataLength', 0))
+            if keepData:
+                message['Data'] = reader.read(length)
+                return message
+            digest = hashlib.sha1()
+            while length > 0:
+                chunk = reader.read(min(length, 64*1024))
+                if not chunk:
+                    return None
+                digest.update(chunk)
+                length -= len(chunk)
+            message['Data'] = digest.hexdigest()
+            return message
+        key, sep, value = line.partition('=')
+        message[key] = value
+
+def wantsProgress(message):
+    """ as the node, SimpleProgress is only sent if the request's Verbosity asks for it """
+    return int(message.get('Verbosity', 0)) & 1
+
+def encodeMessage(header, fields, data=None):
+    lines = [header] + ['%s=%s' % item for item in fields.items()]
+    if data is None:
+        return '\n'.join(lines + ['EndMessage']) + '\n'
+    return '\n'.join(lines + ['DataLength=%d' % len(data), 'Data']) + '\n' + data
+
+class Connection(object):
+    """ a client connected to the FakeNode """
+
+    def __init__(self, node, sock):
+        self.node = node
+        self.socket = sock
+        self.reader = sock.makefile('rb')
+        self.lock = threading.Lock()
+        self.ddaTests = {} # directory -> (read file, content)
+        self.name = None
+        self.watchingGlobal = False
+
+    def send(self, header, data=None, **fields):
+        with self.lock:
+            try:
+                self.socket.sendall(encodeMessage(header, fields, data))
+            except socket.error, e:
+                pass
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error, e:
+            pass
+        self.socket.close()
+
+    def run(self):
+        while True:
+            try:
+                message = readMessage(self.reader, self.node.keepData)
+            except (socket.error, ValueError), e:
+                message = None
+            if message is None:
+                return
+            self.node.received(self, message)
+            if message['header'] == 'Disconnect':
+                self.close()
+                return
+            handler = self.node.handlers.get(message['header'])
+            if handler:
+                handler(self, message)
+
+class FakeNode(object):
+    """ with globalToWatchers the messages of global requests only go to the connections
+        which sent WatchGlobal, not to the one which sent the request """
+
+    def __init__(self, keepData=True, globalToWatchers=False):
+        self.keepData = keepData
+        self.globalToWatchers = globalToWatchers
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.port = self.server.getsockname()[1]
+        self.connections = []
+        self.messages = []
+        self.condition = threading.Condition()
+        self.handlers = {'ClientHello':self.clientHello, 'ClientPut':self.clientPut, 'ClientGet':self.clientGet,
+                         'GetConfig':self.getConfig, 'TestDDARequest':self.testDDARequest,
+                         'TestDDAResponse':self.testDDAResponse, 'WatchGlobal':self.watchGlobal}
+        thread = threading.Thread(target=self.acceptLoop, name='FakeNode')
+        thread.daemon = True
+        thread.start()
+
+    def acceptLoop(self):
+        while True:
+            try:
+                sock, address = self.server.accept()
+            except socket.error, e:
+                return
+            connection = Connection(self, sock)
+            with self.condition:
+                self.connections.append(connection)
+            thread = threading.Thread(target=connection.run, name='FakeNodeConnection')
+            thread.daemon = True
+            thread.start()
+
+    def received(self, connection, message):
+        with self.condition:
+            self.messages.append(message)
+            self.condition.notify_all()
+
+    def waitFor(self, header, count=1, timeout=5):
+        """ the first count received messages with this header """
+        with self.condition:
+            for i in range(int(timeout * 20)):
+                found = [message for message in self.messages if message['header'] == header]
+                if len(found) >= count:
+                    return found[:count]
+                self.condition.wait(0.05)
+        raise AssertionError('%d %s not received in time, got %s' % (count, header, [m['header'] for m in self.messages]))
+
+    def dropConnections(self):
+        """ close all client connections, as a node that goes away """
+        with self.condition:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            connection.close()
+
+    def close(self):
+        self.server.close()
+        self.dropConnections()
+
+    def reply(self, connection, request, header, **fields):
+        """ sends a message about the request to the connections which get it """
+        if self.globalToWatchers and request.get('Global') == 'true':
+            with self.condition:
+                targets = [other for other in self.connections if other.watchingGlobal]
+        else:
+            targets = [connection]
+        for target in targets:
+            target.send(header, **fields)
+
+    # --- scripted answers
+
+    def clientHello(self, connection, message):
+        # as the node, a new connection with the name of an open one replaces it
+        connection.name = message.get('Name')
+        with self.condition:
+            duplicates = [other for other in self.connections if other is not connection and other.name == connection.name]
+            self.connections = [other for other in self.connections if other not in duplicates]
+        for other in duplicates:
+            other.send('CloseConnectionDuplicateClientName')
+            other.close()
+        connection.send('NodeHello', FCPVersion='2.0', Node='Fred', Version='Fred,0.7,1.0,1477', Build='1477', Revision='fake')
+
+    def clientPut(self, connection, message):
+        identifier = message['Identifier']
+        uri = 'CHK@%s' % hashlib.sha1(message.get('Data', message.get('Filename', ''))).hexdigest()
+        if message.get('TargetFilename'):
+            uri += '/' + message['TargetFilename']
+        self.reply(connection, message, 'URIGenerated', Identifier=identifier, URI=uri)
+        if message.get('GetCHKOnly') != 'true' and wantsProgress(message):
+            self.reply(connection, message, 'SimpleProgress', Identifier=identifier, Total='2', Required='2', Succeeded='1',
+                       Failed='0', FatallyFailed='0', FinalizedTotal='true')
+        self.reply(connection, message, 'PutSuccessful', Identifier=identifier, URI=uri)
+
+    def clientGet(self, connection, message):
+        if wantsProgress(message):
+            self.reply(connection, message, 'SimpleProgress', Identifier=message['Identifier'], Total='4', Required='4',
+                       Succeeded='4', Failed='0', FatallyFailed='0', FinalizedTotal='true')
+        self.reply(connection, message, 'DataFound', Identifier=message['Identifier'], DataLength='5',
+                   **{'Metadata.ContentType':'text/plain'})
+
+    def watchGlobal(self, connection, message):
+        connection.watchingGlobal = message.get('Enabled') == 'true'
+
+    def getConfig(self, connection, message):
+        connection.send('ConfigData', Identifier=message['Identifier'],
+                        **{'current.node.downloadsDir':'downloads', 'current.node.cfgDir':'/var/lib/freenet',
+                           'current.security-levels.physicalThreatLevel':'NORMAL'})
+
+    def testDDARequest(self, connection, message):
+        """ asks the client to read a file the node wrote into the directory """
+        directory = message['Directory']
+        fields = {'Directory':directory}
+        if message.get('WantReadDirectory') == 'true':
+            readFile = os.path.join(directory, 'DDACheck-%s.tmp' % os.urandom(4).encode('hex'))
+            content = os.urandom(8).encode('hex')
+            with open(readFile, 'w') as f:
+                f.write(content)
+            connection.ddaTests[directory] = (readFile, content)
+            fields['ReadFilename'] = readFile
+        connection.send('TestDDAReply', **fields)
+
+    def testDDAResponse(self, connection, message):
+        directory = message['Directory']
+        readFile, content = connection.ddaTests.pop(directory, (None, None))
+        if readFile:
+            os.remove(readFile)
+        allowed = readFile is not None and message.get('ReadContent') == content
+        connection.send('TestDDAComplete', Directory=directory, ReadDirectoryAllowed=allowed and 'true' or 'false',
+                        WriteDirectoryAllowed='false')
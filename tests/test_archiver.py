@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import os, os.path, zipfile, zlib, binascii, io
+import pytest
+
+from warren.core.Archiver import Archiver, ZipWriter, ZipEntry
+
+FILES = {'a.txt':'hello\n' * 1000, 'sub/deeper/b.py':'print 1\n' * 50, 'pic.jpg':os.urandom(5000),
+         u'sub/ü.txt'.encode('utf-8'):'x' * 300, 'zero.txt':''}
+
+@pytest.fixture
+def tree(tmpdir):
+    """ the FILES and an empty directory, returns the Archiver entries """
+    tmpdir.mkdir('sub').mkdir('empty')
+    entries = []
+    for name, data in sorted(FILES.items()):
+        path = os.path.join(str(tmpdir), name) # byte names, whatever the file system encoding is
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        entries.append((path, 'top/' + name))
+    return entries
+
+def archive(tmpdir, entries):
+    path = str(tmpdir.join('out.zip'))
+    with open(path, 'w+b') as f:
+        stats = Archiver(2).archive(f, entries, ['top/sub/empty/'])
+    return stats, zipfile.ZipFile(path)
+
+def test_archive(tmpdir, tree):
+    stats, zipFile = archive(tmpdir, tree)
+    assert zipFile.testzip() is None
+    for name, data in FILES.items():
+        assert zipFile.read('top/' + name.decode('utf-8')) == data
+    assert zipFile.namelist() == ['top/' + name.decode('utf-8') for name in sorted(FILES)] + ['top/sub/empty/']
+    methods = dict((info.filename, info.compress_type) for info in zipFile.infolist())
+    assert methods['top/pic.jpg'] == zipfile.ZIP_STORED
+    assert methods['top/a.txt'] == zipfile.ZIP_DEFLATED
+    assert stats.files == len(FILES)
+    assert stats.bytesIn == sum(len(data) for data in FILES.values())
+
+def test_archive_zip64(tmpdir, tree, monkeypatch):
+    # as if the archive was larger than 2 GiB and had more than 65535 entries
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 100)
+    monkeypatch.setattr(zipfile, 'ZIP_FILECOUNT_LIMIT', 3)
+    stats, zipFile = archive(tmpdir, tree)
+    monkeypatch.undo()
+    assert zipFile.testzip() is None
+    assert zipFile.read('top/a.txt') == FILES['a.txt']
+
+def test_zip_writer(tmpdir):
+    stored = tmpdir.join('stored.bin')
+    stored.write('stored data', 'wb')
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = 'deflated data ' * 100
+    deflated = io.BytesIO(compressor.compress(data) + compressor.flush())
+    out = io.BytesIO()
+    writer = ZipWriter(out)
+    writer.writeStored(ZipEntry(u'dir/stored.bin', (2020, 5, 17, 12, 30, 10), 0644 << 16L, zipfile.ZIP_STORED, 11, 11), str(stored))
+    writer.writeDeflated(ZipEntry(u'ünï/cödé.txt', (1970, 1, 1, 0, 0, 0), 0644 << 16L, zipfile.ZIP_DEFLATED, len(data),
+                                  len(deflated.getvalue()), binascii.crc32(data) & 0xffffffff), deflated)
+    writer.writeDirectory('dir/empty/')
+    writer.close()
+    zipFile = zipfile.ZipFile(out)
+    assert zipFile.testzip() is None
+    assert zipFile.read('dir/stored.bin') == 'stored data'
+    assert zipFile.read(u'ünï/cödé.txt') == data
+    assert zipFile.read('dir/empty/') == ''
+    stored, unicodeName, empty = zipFile.infolist()
+    assert stored.date_time == (2020, 5, 17, 12, 30, 10)
+    assert unicodeName.flag_bits & 0x800
+    assert unicodeName.date_time == (1980, 1, 1, 0, 0, 0) # zip has no earlier dates
@@ -0,0 +1,89 @@
+import json, os, os.path, time
+import pytest
+
+from warren import cli
+from warren.core.FileManager import DirectoryInsert, localPath
+
+@pytest.fixture
+def home(tmpdir, monkeypatch):
+    """ an empty settings directory """
+    monkeypatch.setenv('HOME', str(tmpdir.mkdir('home')))
+    return tmpdir
+
+def run(node, capsys, *args):
+    """ exit code and the JSON events of a cli run """
+    code = cli.main(['--port', str(node.port)] + list(args))
+    return code, [json.loads(line) for line in capsys.readouterr()[0].splitlines()]
+
+def puts(node):
+    return [message for message in node.messages if message['header'] == 'ClientPut']
+
+def test_local_path():
+    assert localPath(cli.toUrl('/tmp/my file%.txt')) == '/tmp/my file%.txt'
+
+def test_insert_file_with_space(node, home, capsys):
+    path = home.join('my file.txt')
+    path.write('content')
+    code, events = run(node, capsys, 'insert', str(path))
+    assert code == 0
+    assert events[-1]['event'] == 'inserted'
+    put, = puts(node)
+    assert put['TargetFilename'] == 'my file.txt'
+    assert put.get('Filename', str(path)) == str(path)
+
+def test_insert_directory_with_space(node, home, capsys):
+    directory = home.mkdir('my dir')
+    directory.mkdir('sub').join('a.txt').write('content')
+    code, events = run(node, capsys, 'insert', str(directory))
+    assert code == 0
+    assert events[-1]['event'] == 'inserted'
+    put, = puts(node)
+    assert put['TargetFilename'] == 'my dir.zip'
+    assert int(put['DataLength']) > 100 # not an empty archive
+
+def test_missing_directory_fails(tmpdir):
+    insert = DirectoryInsert(None, cli.toUrl(str(tmpdir.join('gone dir'))))
+    with pytest.raises(IOError):
+        insert.insert()
+
+def test_put_failed_exit_code(node, home, capsys):
+    def putFailed(connection, message):
+        connection.send('PutFailed', Identifier=message['Identifier'], Code='10', CodeDescription='Insert failed')
+    node.handlers['ClientPut'] = putFailed
+    path = home.join('file.txt')
+    path.write('content')
+    code, events = run(node, capsys, 'insert', str(path))
+    assert code == 1
+    assert events[-1] == {'event':'failed', 'items':[cli.toUrl(str(path))], 'error':'Insert failed'}
+
+def connectedEngine(node, engineClass=cli.CliEngine, *args):
+    from warren.core.Config import Config
+    config = Config()
+    config['node']['fcp_port'] = node.port
+    engine = engineClass(config, *args)
+    engine.startWatchdog()
+    assert engine.waitConnected(5)
+    return engine
+
+def test_insert_error_fails(node, home):
+    engine = connectedEngine(node, cli.CliEngine, open(os.devnull, 'w'))
+    try:
+        # the directory is gone by the time the insert runs
+        engine.insert([(cli.toUrl(str(home.join('gone'))), 'directory')])
+        assert engine.waitFinished(5)
+        assert engine.failed
+    finally:
+        engine.stop()
+
+def test_client_names_differ(node, home):
+    # the node closes a connection when another one uses its name
+    from warren.core.Engine import Engine
+    engine = connectedEngine(node, Engine)
+    cliEngine = connectedEngine(node, cli.CliEngine, open(os.devnull, 'w'))
+    try:
+        time.sleep(0.2)
+        assert engine.node.running and cliEngine.node.running
+        assert engine.clientName() != cliEngine.clientName()
+    finally:
+        cliEngine.stop()
+        engine.stop()
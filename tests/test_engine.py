@@ -0,0 +1,57 @@
+import time
+
+from warren.core.Engine import Engine
+from test_cli import connectedEngine
+
+class FastEngine(Engine):
+    rebalanceInterval = 0.5
+
+def test_rebalance_on_timer(node):
+    # the only progress of a request arrives right after a rebalance, it is promoted by the next one
+    def putRunning(connection, message):
+        assert message['Verbosity'] == '1'
+        connection.send('SimpleProgress', Identifier=message['Identifier'], Total='100', Required='100', Succeeded='99',
+                        Failed='0', FatallyFailed='0', FinalizedTotal='true')
+    node.handlers['ClientPut'] = putRunning
+    engine = connectedEngine(node, FastEngine)
+    try:
+        priority, realtime = engine.insertPriority('Warren-big', 100 * 1024 * 1024)
+        assert priority > engine.priorities.value('small_insert')
+        engine.rebalanced = time.time()
+        engine.node.submit('Warren-big', 'ClientPut', {'URI':'CHK@', 'Global':True, 'Persistence':'forever',
+                                                       'PriorityClass':priority, 'UploadFrom':'direct'}, 'data')
+        modify, = node.waitFor('ModifyPersistentRequest')
+        assert modify['Identifier'] == 'Warren-big'
+        assert modify['PriorityClass'] == str(engine.priorities.value('small_insert'))
+    finally:
+        engine.stop()
+
+def configRequests(node):
+    return [message for message in node.messages if message['header'] == 'GetConfig']
+
+def reconnect(node, engine):
+    old = engine.node
+    node.dropConnections()
+    for i in range(100):
+        if engine.node not in (None, old) and engine.waitConnected(0):
+            return
+        time.sleep(0.05)
+    raise AssertionError('not reconnected')
+
+def test_config_checked_once_per_session(node, tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    engine = connectedEngine(node, Engine)
+    try:
+        reconnect(node, engine)
+        time.sleep(0.2)
+        assert len(configRequests(node)) == 1 # asked for on the first connect, the profile is stored
+    finally:
+        engine.stop()
+    engine = connectedEngine(node, Engine)
+    try:
+        node.waitFor('GetConfig', 2) # the stored profile is checked in the background
+        reconnect(node, engine)
+        time.sleep(0.2)
+        assert len(configRequests(node)) == 2
+    finally:
+        engine.stop()
@@ -0,0 +1,159 @@
+from StringIO import StringIO
+import threading, time
+import pytest
+
+from warren.core.FCPClient import FCPClient, FCPError
+from warren.core.Streaming import StreamPayload
+
+def test_hello(node, client):
+    assert client.nodeHello['header'] == 'NodeHello'
+    assert client.nodeHello['Build'] == '1477'
+    assert node.waitFor('ClientHello')[0]['Name'] == 'test'
+
+def test_put_direct(node, client):
+    messages = []
+    result = client.put(data='hello', name='a.txt', async=False, timeout=5,
+                        callback=lambda status, message: messages.append((status, message['header'])))
+    assert result['header'] == 'PutSuccessful'
+    assert result['URI'].endswith('/a.txt')
+    # Verbosity 0, no SimpleProgress
+    assert messages == [('pending', 'URIGenerated'), ('successful', 'PutSuccessful')]
+    put = node.waitFor('ClientPut')[0]
+    assert put['Data'] == 'hello'
+    assert put['DataLength'] == '5'
+    assert put['UploadFrom'] == 'direct'
+
+def test_global_requests_progress(node, client):
+    # the progress table shows the global queue from the SimpleProgress messages
+    messages = []
+    callback = lambda status, message: messages.append(message['header'])
+    client.put(data='hello', Global=True, persistence='forever', async=False, timeout=5, callback=callback)
+    client.get('CHK@abc/file', Global=True, persistence='forever', async=False, timeout=5, callback=callback)
+    client.submit('dir', 'ClientPutComplexDir', {'URI':'CHK@', 'Global':True}, async=True)
+    assert messages.count('SimpleProgress') == 2
+    assert [message['Verbosity'] for message in node.waitFor('ClientPut') + node.waitFor('ClientGet')] == ['1', '1']
+    assert node.waitFor('ClientPutComplexDir')[0]['Verbosity'] == '1'
+
+def test_put_stream_payload(node, client):
+    data = 'x' * 300000
+    job = client.put(data=StreamPayload(StringIO(data), len(data)), name='big', waituntilsent=True)
+    assert job.wait(5)['header'] == 'PutSuccessful'
+    assert node.waitFor('ClientPut')[0]['Data'] == data
+    assert client.queuedBytes == 0
+
+def test_put_chk_only(node, client):
+    result = client.put(data='hello', chkonly=True, async=False, timeout=5)
+    assert result['URI'].startswith('CHK@')
+    assert node.waitFor('ClientPut')[0]['GetCHKOnly'] == 'true'
+
+def test_get_to_disk(node, client, tmpdir):
+    target = str(tmpdir.join('file'))
+    result = client.get('CHK@abc/file', file=target, async=False, timeout=5)
+    assert result['header'] == 'DataFound'
+    get = node.waitFor('ClientGet')[0]
+    assert get['ReturnType'] == 'disk'
+    assert get['Filename'] == target
+
+def test_getconfig(node, client):
+    config = client.getconfig(async=False, timeout=5, WithCurrent=True)
+    assert config['current.node.downloadsDir'] == 'downloads'
+
+def test_testDDA_read(node, client, tmpdir):
+    result = client.testDDA(Directory=str(tmpdir), WantReadDirectory=True, timeout=5)
+    assert result['header'] == 'TestDDAComplete'
+    assert result['ReadDirectoryAllowed'] == 'true'
+    assert not client.ddaTests
+
+def test_testDDA_shared(node, client, tmpdir):
+    """ tests of the same directory while one is running wait for the running one """
+    held = []
+    node.handlers['TestDDARequest'] = lambda connection, message: held.append((connection, message))
+    jobs = [client.testDDA(async=True, Directory=str(tmpdir), WantReadDirectory=True) for i in range(3)]
+    assert jobs[0] is jobs[1] is jobs[2]
+    node.waitFor('TestDDARequest')
+    node.testDDARequest(*held[0])
+    jobs[0].done.wait(5)
+    assert jobs[0].result['ReadDirectoryAllowed'] == 'true'
+    assert len([m for m in node.messages if m['header'] == 'TestDDARequest']) == 1
+    assert not client.ddaTests
+
+def test_testDDA_more_access(node, client, tmpdir):
+    """ a test which wants more access than the running one isn't shared """
+    node.handlers['TestDDARequest'] = lambda connection, message: None
+    read = client.testDDA(async=True, Directory=str(tmpdir), WantReadDirectory=True)
+    write = client.testDDA(async=True, Directory=str(tmpdir), WantWriteDirectory=True)
+    assert read is not write
+    node.waitFor('TestDDARequest', count=2)
+
+def test_identifier_routing(node, client):
+    """ answers go to the request with their Identifier, whatever their order """
+    node.handlers['ClientPut'] = lambda connection, message: None
+    watched = []
+    client.addWatcher(lambda message: watched.append(message['Identifier']))
+    first = client.put(data='1', id='first')
+    second = client.put(data='2', id='second')
+    node.waitFor('ClientPut', count=2)
+    connection = node.connections[0]
+    connection.send('PutSuccessful', Identifier='second', URI='CHK@second')
+    connection.send('URIGenerated', Identifier='other', URI='CHK@other')
+    connection.send('PutSuccessful', Identifier='first', URI='CHK@first')
+    assert second.wait(5)['URI'] == 'CHK@second'
+    assert first.wait(5)['URI'] == 'CHK@first'
+    assert watched == ['second', 'other', 'first']
+    assert not client.jobs
+
+def test_identifier_collision(node, client):
+    node.handlers['ClientPut'] = lambda connection, message: connection.send('IdentifierCollision', Identifier=message['Identifier'], Global='false')
+    job = client.put(data='1', id='taken')
+    with pytest.raises(FCPError):
+        job.wait(5)
+    assert job.failed
+    assert job.result['header'] == 'IdentifierCollision'
+
+def test_connection_lost(node, client):
+    node.handlers['ClientPut'] = lambda connection, message: None
+    closed = threading.Event()
+    client.addCloseHandler(lambda fcpClient: closed.set())
+    job = client.put(data='1')
+    node.waitFor('ClientPut')
+    node.dropConnections()
+    assert closed.wait(5) or closed.isSet()
+    with pytest.raises(FCPError):
+        job.wait(5)
+    assert not client.running
+    with pytest.raises(FCPError):
+        client.put(data='2')
+    # a close handler added later is called at once
+    late = []
+    client.addCloseHandler(late.append)
+    assert late == [client]
+
+def test_shutdown_sends_disconnect(node, client):
+    client.shutdown()
+    node.waitFor('Disconnect')
+
+def test_shutdown_sends_queued(node, client):
+    # as the command line client, which queues downloads and exits
+    for i in range(50):
+        client.get('CHK@key%d/file' % i, Global=True, persistence='forever')
+    client.shutdown()
+    assert not client.writer.isAlive()
+    node.waitFor('Disconnect')
+    headers = [message['header'] for message in node.messages if message['header'] in ('ClientGet', 'Disconnect')]
+    assert headers == ['ClientGet'] * 50 + ['Disconnect']
+
+def test_no_node():
+    with pytest.raises(Exception):
+        FCPClient('test', port=1)
+
+def test_duplicate_name(node, client):
+    other = FCPClient('test', port=node.port)
+    try:
+        for i in range(100):
+            if not client.running:
+                break
+            time.sleep(0.05)
+        assert not client.running
+        assert other.running
+    finally:
+        other.shutdown()
@@ -0,0 +1,27 @@
+import pytest
+
+from warren.core.FCPPool import FCPPool, SMALL_PAYLOAD
+
+@pytest.fixture
+def pool(node):
+    fcpPool = FCPPool('test', port=node.port)
+    yield fcpPool
+    fcpPool.shutdown()
+
+def test_small_payload_on_control(pool):
+    assert pool.forData(100) is pool.control
+
+def test_global_put_on_data_connection(node, pool):
+    # as the node, the messages of global requests only go to the connection watching the global queue
+    node.globalToWatchers = True
+    pool.control.watchGlobal(True)
+    node.waitFor('WatchGlobal')
+    client = pool.forData(SMALL_PAYLOAD + 1)
+    assert client is not pool.control
+    statuses = []
+    job = client.put(data='x' * (SMALL_PAYLOAD + 1), Global=True, persistence='forever', id='Warren-big',
+                     callback=lambda status, message: statuses.append(message['header']))
+    assert job.wait(5)['header'] == 'PutSuccessful'
+    assert statuses == ['URIGenerated', 'SimpleProgress', 'PutSuccessful']
+    put, = node.waitFor('ClientPut')
+    assert put['Global'] == 'true'
@@ -0,0 +1,74 @@
+import threading
+
+from warren.core.InsertScheduler import InsertScheduler, PRIORITY_HIGH
+
+class Job(object):
+    """ runs until it is released """
+
+    def __init__(self, size, log=None):
+        self.bytes = size
+        self.log = log
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def size(self):
+        return self.bytes
+
+    def run(self):
+        if self.log is not None:
+            self.log.append(self)
+        self.started.set()
+        self.released.wait(5)
+
+def test_byte_budget():
+    scheduler = InsertScheduler(workers=3, maxBytesInFlight=100)
+    try:
+        first, second, small = Job(60), Job(60), Job(30)
+        for job in first, second, small:
+            scheduler.submit(job)
+        assert first.started.wait(5)
+        # the second job doesn't fit, the small one is admitted after it
+        assert not second.started.wait(0.2)
+        assert not small.started.isSet()
+        first.released.set()
+        assert second.started.wait(5)
+        assert small.started.wait(5)
+        second.released.set()
+        small.released.set()
+    finally:
+        scheduler.stop()
+
+def test_oversized_job_runs_alone():
+    scheduler = InsertScheduler(workers=3, maxBytesInFlight=100)
+    try:
+        running, large, after = Job(10), Job(500), Job(10)
+        scheduler.submit(running)
+        assert running.started.wait(5)
+        scheduler.submit(large)
+        scheduler.submit(after)
+        assert not large.started.wait(0.2)
+        running.released.set()
+        assert large.started.wait(5)
+        assert not after.started.wait(0.2)
+        large.released.set()
+        assert after.started.wait(5)
+        after.released.set()
+    finally:
+        scheduler.stop()
+
+def test_priority_order():
+    log = []
+    scheduler = InsertScheduler(workers=1)
+    try:
+        blocker = Job(1, log)
+        scheduler.submit(blocker)
+        assert blocker.started.wait(5)
+        normal, high = Job(1, log), Job(1, log)
+        scheduler.submit(normal)
+        scheduler.submit(high, PRIORITY_HIGH)
+        for job in blocker, normal, high:
+            job.released.set()
+        assert normal.started.wait(5)
+        assert log == [blocker, high, normal]
+    finally:
+        scheduler.stop()
@@ -0,0 +1,56 @@
+import os, os.path, json, time
+
+from warren.core.Journal import InsertJournal, MAX_ATTEMPTS
+from test_cli import connectedEngine
+
+def test_add_update_remove(tmpdir):
+    journal = InsertJournal(str(tmpdir.join('journal')))
+    first = journal.add([('file:///a', 'text/plain')])
+    second = journal.add([('file:///b', 'directory')])
+    assert first != second
+    journal.update(first, state='sent')
+    journal.update('unknown', state='sent') # gone already
+    journal.remove(second)
+    assert journal.unfinished() == [(first, {'items':[('file:///a', 'text/plain')], 'state':'sent', 'attempts':0})]
+    assert journal.unfinished(exclude=set([first])) == []
+
+def test_unfinished_drops_failed(tmpdir):
+    journal = InsertJournal(str(tmpdir.join('journal')))
+    journalId = journal.add([('file:///a', 'text/plain')])
+    journal.update(journalId, attempts=MAX_ATTEMPTS)
+    assert journal.unfinished() == []
+    assert InsertJournal(journal.filename).entries == {}
+
+def test_reload_after_crash(tmpdir):
+    filename = str(tmpdir.join('journal'))
+    journal = InsertJournal(filename)
+    journalId = journal.add([('file:///a', 'text/plain')])
+    journal.update(journalId, state='sending')
+    # a crash while the next write was going on leaves the temporary file behind
+    tmpdir.join('journal.tmp').write('{"broken')
+    reloaded = InsertJournal(filename)
+    assert [entry['state'] for journalId, entry in reloaded.unfinished()] == ['sending']
+    assert reloaded.add([('file:///b', 'text/plain')]) != journalId
+    tmpdir.join('journal').write('{"broken')
+    assert InsertJournal(filename).unfinished() == []
+
+def test_resume_after_crash(node, tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    path = tmpdir.join('file.txt')
+    path.write('content')
+    os.mkdir(str(tmpdir.join('.warren')))
+    journalFile = str(tmpdir.join('.warren', 'journal'))
+    with open(journalFile, 'w') as f:
+        json.dump({'5f000000-000001':{'items':[['file://' + str(path), 'text/plain']], 'state':'sending', 'attempts':1}}, f)
+    from warren.core.Engine import Engine
+    engine = connectedEngine(node, Engine)
+    try:
+        put, = node.waitFor('ClientPut')
+        assert put['TargetFilename'] == 'file.txt'
+        for i in range(100):
+            if not InsertJournal(journalFile).entries:
+                break
+            time.sleep(0.05)
+        assert InsertJournal(journalFile).entries == {}
+    finally:
+        engine.stop()
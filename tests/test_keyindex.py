@@ -0,0 +1,38 @@
+from warren.core.KeyIndex import KeyIndex, hashEntries, hashFile
+
+def test_lookup(tmpdir):
+    index = KeyIndex(str(tmpdir.join('keys')))
+    assert index.lookup('abc', 'CHK@') is None
+    index.add('abc', 'CHK@', 'CHK@key/file.txt')
+    assert index.lookup('abc', 'CHK@') == 'CHK@key/file.txt'
+    assert index.lookup('abc', 'SSK@') is None
+    assert index.lookup('def', 'CHK@') is None
+
+def test_persistence(tmpdir):
+    filename = str(tmpdir.join('keys'))
+    index = KeyIndex(filename)
+    index.add('abc', 'CHK@', 'CHK@old')
+    index.add('abc', 'CHK@', 'CHK@new')
+    index.add('abc', 'CHK@', 'CHK@new') # known, not written again
+    index.add('def', 'SSK@', 'SSK@other')
+    assert len(open(filename).readlines()) == 3
+    index = KeyIndex(filename)
+    assert index.lookup('abc', 'CHK@') == 'CHK@new'
+    assert index.lookup('def', 'SSK@') == 'SSK@other'
+
+def test_recorder(tmpdir):
+    index = KeyIndex(str(tmpdir.join('keys')))
+    callback = index.recorder('abc', 'CHK@')
+    callback('pending', {'header':'URIGenerated', 'URI':'CHK@early'})
+    callback('failed', {'header':'PutFailed'})
+    assert index.lookup('abc', 'CHK@') is None
+    callback('successful', {'header':'PutSuccessful', 'URI':'CHK@done'})
+    assert index.lookup('abc', 'CHK@') == 'CHK@done'
+
+def test_hash_entries(tmpdir):
+    tmpdir.join('a').write('a')
+    tmpdir.join('b').write('b')
+    entries = [('a', str(tmpdir.join('a')), 'text/plain'), ('b', str(tmpdir.join('b')), 'text/plain')]
+    assert hashEntries(entries) == hashEntries(entries[::-1], workers=1)
+    assert hashEntries(entries) != hashEntries([('a', str(tmpdir.join('b')), 'text/plain'), entries[1]])
+    assert hashFile(str(tmpdir.join('a'))) == 'ca978112ca1bbdcafac231b39a23dc4da786eff8147c4e72b9807785afee48bb'
@@ -0,0 +1,28 @@
+from pygments.lexers import get_lexer_by_name
+
+from warren.core.LanguageGuess import LanguageGuess
+
+def alias(name):
+    return get_lexer_by_name(name).aliases[0]
+
+def test_shebang():
+    guess = LanguageGuess()
+    assert guess.guess(u'#!/usr/bin/env python2.7\nprint 1\n') == alias('python')
+    assert guess.guess(u'#!/bin/bash -e\necho 1\n') == alias('bash')
+    assert guess.guess(u'#!/usr/bin/unknown-interpreter\n') == 'text'
+
+def test_modeline():
+    guess = LanguageGuess(sampleSize=1024)
+    assert guess.guess(u'# -*- mode: ruby; coding: utf-8 -*-\nputs 1\n') == alias('ruby')
+    # the modeline is at the end of a text longer than both samples
+    text = u'x\n' * 5000 + u'# vim: set ft=lua:\n'
+    assert guess.guess(text) == alias('lua')
+
+def test_budget():
+    guess = LanguageGuess(budget=0)
+    text = u'some words, nothing which looks like code\n'
+    assert guess.guess(text) # whatever was rated by then, at least 'text'
+    assert guess.cache == {} # ran out of time, not cached
+    guess.budget = 60
+    assert guess.guess(text) == 'text'
+    assert guess.cache.values() == ['text']
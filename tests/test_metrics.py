@@ -0,0 +1,18 @@
+import json
+
+from warren.core.Metrics import Metrics, MetricsLog
+
+def test_metrics_log(tmpdir):
+    metrics = Metrics()
+    metrics.count('warren_inserts_total')
+    first = MetricsLog(metrics, str(tmpdir.join('first.log')), interval=60)
+    second = MetricsLog(metrics, str(tmpdir.join('second.log')), interval=60)
+    first.stop()
+    metrics.count('warren_inserts_total')
+    second.stop()
+    assert len(first.log.handlers) == 0 and len(second.log.handlers) == 0
+    # each log got the snapshot written when it was stopped, and only that one
+    for name, count in (('first.log', 1), ('second.log', 2)):
+        lines = tmpdir.join(name).readlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])['metrics'] == {'warren_inserts_total':count}
@@ -0,0 +1,37 @@
+import sys, io
+
+from warren.core import PasteRenderer as module
+from warren.core.PasteRenderer import PasteRenderer, CHUNK_SIZE, MAX_CHUNK_SIZE, textChunks, lineCount
+
+def test_chunks_end_at_line_ends():
+    text = u'x = 1\n' * (CHUNK_SIZE / 2)
+    chunks = list(textChunks(text))
+    assert len(chunks) > 1
+    assert u''.join(chunks) == text
+    assert all(chunk.endswith(u'\n') and CHUNK_SIZE <= len(chunk) <= MAX_CHUNK_SIZE for chunk in chunks[:-1])
+
+def test_long_lines_are_split():
+    text = u'a' * (MAX_CHUNK_SIZE + 10) + u'\n' + u'b' * 3 * MAX_CHUNK_SIZE
+    chunks = list(textChunks(text))
+    assert u''.join(chunks) == text
+    assert len(chunks) == 5
+    assert all(len(chunk) == MAX_CHUNK_SIZE for chunk in chunks[:-1])
+
+def test_surrogate_pair_kept_together():
+    # a surrogate pair across the limit
+    text = u'a' * (MAX_CHUNK_SIZE - 1) + u'\ud83d\ude00' + u'a' * 10
+    chunks = list(textChunks(text))
+    assert u''.join(chunks) == text
+    assert len(chunks[0]) == MAX_CHUNK_SIZE - 1
+
+def test_chunked_render_equals_unchunked(monkeypatch):
+    monkeypatch.setattr(module, 'CHUNK_SIZE', 1024)
+    monkeypatch.setattr(module, 'MAX_CHUNK_SIZE', 2048)
+    text = u'def f(x):\n    return x * 2 # comment\n\n' * 200
+    assert len(list(textChunks(text))) > 4
+    renderer = PasteRenderer(workerMinSize=sys.maxint)
+    for compact in (False, True):
+        page = renderer.renderPage(text, 'python', linenos=True, compact=compact)
+        out = io.BytesIO()
+        renderer.renderTo(out, textChunks(text), 'python', lineCount(text), True, compact=compact)
+        assert out.getvalue() == page
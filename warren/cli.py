@@ -0,0 +1,218 @@
+""" warren without a display: inserts files and directories, queues downloads or runs as a
+    daemon which reads commands from stdin. Results are written to stdout as JSON lines """
+
+from warren.core.Config import Config
+from warren.core.Engine import Engine
+from warren.core.FileManager import analyzeUrl
+from optparse import OptionParser
+import json, threading, urllib, sys, time
+import os.path
+
+USAGE = """%prog [options] insert PATH|URL...
+       %prog [options] download [KEY...]
+       %prog [options] daemon
+
+insert   inserts each item, or all of them as one manifest with --manifest
+download puts the keys on the node's download queue, they are read from stdin without arguments
+daemon   reads JSON lines from stdin, {"insert": [PATH|URL, ...], "manifest": false} or {"download": [KEY, ...]}"""
+
+CONNECT_TIMEOUT = 30
+
+class CliEngine(Engine):
+    """ writes the results of the inserts as JSON lines and keeps track of the unfinished and the failed ones """
+
+    role = 'cli'
+
+    def __init__(self, config, out, waitInserted=False):
+        Engine.__init__(self, config)
+        self.out = out
+        self.waitInserted = waitInserted
+        self.lock = threading.Condition()
+        self.pending = set() # journal ids
+        self.failed = set()
+
+    def write(self, **event):
+        with self.lock:
+            self.out.write(json.dumps(event, sort_keys=True) + '\n')
+            self.out.flush()
+
+    def insert(self, items):
+        """ items is a list of (url, content-type) """
+        with self.lock:
+            fileInsert = self.insertFiles(items)
+            self.pending.add(fileInsert.journalId)
+        return fileInsert
+
+    def finished(self, fileInsert, failed=False):
+        with self.lock:
+            self.pending.discard(fileInsert.journalId)
+            if failed:
+                self.failed.add(fileInsert.journalId)
+            self.lock.notify_all()
+
+    def waitFinished(self, timeout=None):
+        """ returns True when all inserts have a key (or are inserted with waitInserted) or failed """
+        deadline = timeout is not None and time.time() + timeout
+        with self.lock:
+            while self.pending:
+                wait = 1 # short waits, so ctrl-c works
+                if deadline:
+                    wait = min(wait, deadline - time.time())
+                    if wait <= 0:
+                        break
+                self.lock.wait(wait)
+            return not self.pending
+
+    def nodeStateChanged(self, connected):
+        self.write(event=connected and 'connected' or 'disconnected')
+
+    def insertDone(self, fileInsert):
+        Engine.insertDone(self, fileInsert)
+        if fileInsert.error is not None:
+            self.write(event='failed', items=itemUrls(fileInsert), error=str(fileInsert.error))
+            self.finished(fileInsert, failed=True)
+
+    def insertKeyKnown(self, key, fileInsert):
+        self.write(event='key', items=itemUrls(fileInsert), key=key, known=True)
+        self.finished(fileInsert)
+
+    def insertKeyGenerated(self, key, fileInsert):
+        self.write(event='key', items=itemUrls(fileInsert), key=key, known=False)
+        if not self.waitInserted:
+            self.finished(fileInsert)
+
+    def insertCompleted(self, fileInsert, status, message):
+        if status == 'successful':
+            self.write(event='inserted', items=itemUrls(fileInsert), key=message.get('URI'))
+        else:
+            self.write(event='failed', items=itemUrls(fileInsert),
+                       error=message.get('CodeDescription', message.get('header')))
+        self.finished(fileInsert, failed=status != 'successful')
+
+def itemUrls(fileInsert):
+    return [url for url, mimeType in getattr(fileInsert, 'items', [])]
+
+def toUrl(item):
+    """ local paths become file urls """
+    if '://' in item:
+        return item
+    return 'file://' + urllib.pathname2url(os.path.abspath(item))
+
+def analyzeItems(engine, items):
+    """ returns a list of (url, content-type), None if an item can't be inserted """
+    result = []
+    for item in items:
+        fileinfo = analyzeUrl(toUrl(item), engine.config['proxy']['http'])
+        if not fileinfo:
+            engine.write(event='failed', items=[item], error='Can not be inserted')
+            return None
+        result.append(fileinfo)
+    return result
+
+def insertItems(engine, items, manifest=False):
+    items = analyzeItems(engine, items)
+    if not items:
+        return False
+    if manifest:
+        engine.insert(items)
+    else:
+        for item in items:
+            engine.insert([item])
+    return True
+
+def queueDownloads(engine, keys):
+    failed = False
+    for key, error in engine.putKeysOnQueue(keys):
+        if error:
+            engine.write(event='failed', key=key, error=error)
+            failed = True
+        else:
+            engine.write(event='queued', key=key)
+    return not failed
+
+def readKeys(lines):
+    """ keys from lines which are a key, a JSON string or an object with a 'key' """
+    keys = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError, e:
+            value = line
+        if isinstance(value, dict):
+            value = value.get('key')
+        if value:
+            keys.append(str(value))
+    return keys
+
+def runDaemon(engine, manifest=False):
+    for line in iter(sys.stdin.readline, ''):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            command = json.loads(line)
+            if not isinstance(command, dict):
+                raise ValueError('not an object')
+        except ValueError, e:
+            engine.write(event='error', line=line, error='Invalid JSON command: %s' % e)
+            continue
+        if 'insert' in command:
+            items = command['insert']
+            if not isinstance(items, list):
+                items = [items]
+            insertItems(engine, [unicode(item).encode('utf-8') for item in items], command.get('manifest', manifest))
+        if 'download' in command:
+            keys = command['download']
+            if not isinstance(keys, list):
+                keys = [keys]
+            queueDownloads(engine, [str(key) for key in keys])
+    return engine.waitFinished()
+
+def main(argv=None):
+    parser = OptionParser(usage=USAGE)
+    parser.add_option('--host', help='host of the node')
+    parser.add_option('--port', type='int', help="port of the node's FCP interface")
+    parser.add_option('--workers', type='int', help='number of parallel inserts')
+    parser.add_option('--connections', type='int', help='number of FCP connections')
+    parser.add_option('--manifest', action='store_true', default=False, help='insert all items as one manifest with a single key')
+    parser.add_option('--wait', action='store_true', default=False, help='wait until the inserts are finished, not only until their key is known')
+    parser.add_option('--timeout', type='float', help='give up waiting for the inserts after TIMEOUT seconds')
+    options, args = parser.parse_args(argv)
+    if not args or args[0] not in ('insert', 'download', 'daemon'):
+        parser.error('command missing')
+    command, args = args[0], args[1:]
+    if command == 'insert' and not args:
+        parser.error('nothing to insert')
+
+    config = Config()
+    for section, name, value in (('node', 'host', options.host), ('node', 'fcp_port', options.port),
+                                 ('node', 'fcp_connections', options.connections),
+                                 ('warren', 'insert_workers', options.workers)):
+        if value is not None:
+            config[section][name] = value # not written to the settings file
+
+    engine = CliEngine(config, sys.stdout, waitInserted=options.wait)
+    engine.startWatchdog()
+    try:
+        if not engine.waitConnected(CONNECT_TIMEOUT):
+            engine.write(event='failed', error='Node not connected')
+            return 2
+        if command == 'insert':
+            if not insertItems(engine, args, options.manifest):
+                return 1
+            ok = engine.waitFinished(options.timeout)
+        elif command == 'download':
+            ok = queueDownloads(engine, args or readKeys(sys.stdin))
+        else:
+            ok = runDaemon(engine, options.manifest)
+        return (not ok or engine.failed) and 1 or 0
+    except KeyboardInterrupt, e:
+        return 1
+    finally:
+        engine.stop()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+from multiprocessing.pool import ThreadPool
+from multiprocessing import cpu_count
+from collections import deque
+import zipfile, zlib, binascii, struct
+import os, os.path, sys, time, tempfile, shutil
+from Streaming import CHUNK_SIZE
+
+ENTRY_SPOOL_SIZE = 1024 * 1024 # compressed entries up to this size stay in memory until written
+
+# the records of the zip format, see PKWARE's APPNOTE.TXT
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+END_RECORD = struct.Struct('<4s4H2LH')
+ZIP64_END_RECORD = struct.Struct('<4sQ2H2L4Q')
+ZIP64_LOCATOR = struct.Struct('<4sLQL')
+CREATE_SYSTEM = sys.platform == 'win32' and 0 or 3 # as zipfile, for the meaning of external_attr
+
+# these are compressed already, deflating them again only burns cpu time
+STORED_EXTENSIONS = frozenset(['.jpg', '.jpeg', '.png', '.gif', '.webp',
+                               '.mp3', '.ogg', '.oga', '.flac', '.m4a', '.aac', '.opus',
+                               '.mp4', '.m4v', '.mkv', '.avi', '.mov', '.webm', '.ogv', '.wmv', '.flv',
+                               '.zip', '.gz', '.tgz', '.bz2', '.tbz2', '.xz', '.txz', '.lzma', '.7z', '.rar', '.jar',
+                               '.apk', '.deb', '.rpm', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub', '.pdf'])
+
+def isCompressed(filePath):
+    return os.path.splitext(filePath)[1].lower() in STORED_EXTENSIONS
+
+def deflateFile(filePath):
+    """ raw-deflate filePath into a spooled temporary file. Runs in the worker threads,
+        zlib and file reads release the GIL so this scales with the number of cores """
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    spool = tempfile.SpooledTemporaryFile(max_size=ENTRY_SPOOL_SIZE)
+    crc = 0
+    fileSize = 0
+    with open(filePath, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            fileSize += len(chunk)
+            crc = binascii.crc32(chunk, crc)
+            spool.write(compressor.compress(chunk))
+    spool.write(compressor.flush())
+    return (crc & 0xffffffff, fileSize, spool)
+
+class ZipEntry(object):
+    """ a member of the archive and its local and central directory headers """
+
+    def __init__(self, name, dateTime, externalAttr, method, fileSize, compressSize, crc=0):
+        if not isinstance(name, unicode):
+            try:
+                name = name.decode('utf-8') # the file system names of most systems
+            except UnicodeDecodeError, e:
+                pass
+        if isinstance(name, unicode):
+            try:
+                name, self.flags = name.encode('ascii'), 0
+            except UnicodeEncodeError, e:
+                name, self.flags = name.encode('utf-8'), 0x800
+        else:
+            self.flags = 0
+        self.name = name
+        dateTime = max(tuple(dateTime), (1980, 1, 1, 0, 0, 0)) # zip has no earlier dates
+        self.dosDate = (dateTime[0] - 1980) << 9 | dateTime[1] << 5 | dateTime[2]
+        self.dosTime = dateTime[3] << 11 | dateTime[4] << 5 | dateTime[5] // 2
+        self.externalAttr = externalAttr
+        self.method = method
+        self.fileSize = fileSize
+        self.compressSize = compressSize
+        self.crc = crc
+        self.offset = 0
+        # the sizes in the local header need a zip64 field, it can't be added once the data is written
+        self.zip64 = max(fileSize, compressSize) > zipfile.ZIP64_LIMIT
+
+    def localHeader(self):
+        fileSize, compressSize, extra, version = self.fileSize, self.compressSize, '', 20
+        if self.zip64:
+            extra = struct.pack('<2H2Q', 1, 16, fileSize, compressSize)
+            fileSize, compressSize, version = 0xffffffff, 0xffffffff, 45
+        return LOCAL_HEADER.pack('PK\003\004', version, 0, self.flags, self.method, self.dosTime, self.dosDate,
+                                 self.crc, compressSize, fileSize, len(self.name), len(extra)) + self.name + extra
+
+    def centralHeader(self):
+        values = [self.fileSize, self.compressSize, self.offset]
+        large = [value for value in values if value > zipfile.ZIP64_LIMIT]
+        fileSize, compressSize, offset = [min(value, 0xffffffff) for value in values]
+        extra = large and struct.pack('<2H%dQ' % len(large), 1, 8*len(large), *large) or ''
+        version = (large or self.zip64) and 45 or 20
+        return CENTRAL_HEADER.pack('PK\001\002', version, CREATE_SYSTEM, version, 0, self.flags, self.method,
+                                   self.dosTime, self.dosDate, self.crc, compressSize, fileSize, len(self.name),
+                                   len(extra), 0, 0, 0, self.externalAttr, offset) + self.name + extra
+
+class ZipWriter(object):
+    """ writes a zip archive to a seekable file. Unlike zipfile it takes entries which are
+        deflated already, so they can be compressed in other threads """
+
+    def __init__(self, fileObj):
+        self.fp = fileObj
+        self.entries = []
+
+    def writeDeflated(self, entry, data):
+        """ entry has the crc and sizes, data is the deflated content """
+        entry.offset = self.fp.tell()
+        self.fp.write(entry.localHeader())
+        data.seek(0)
+        shutil.copyfileobj(data, self.fp, CHUNK_SIZE)
+        self.entries.append(entry)
+
+    def writeStored(self, entry, filePath):
+        """ copies the file, the crc and size in the local header are filled in afterwards """
+        entry.offset = self.fp.tell()
+        self.fp.write(entry.localHeader())
+        crc, size = 0, 0
+        with open(filePath, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = binascii.crc32(chunk, crc)
+                size += len(chunk)
+                self.fp.write(chunk)
+        if (size > zipfile.ZIP64_LIMIT) != entry.zip64:
+            raise zipfile.LargeZipFile('%s changed its size while it was archived' % filePath)
+        entry.crc, entry.fileSize, entry.compressSize = crc & 0xffffffff, size, size
+        end = self.fp.tell()
+        self.fp.seek(entry.offset)
+        self.fp.write(entry.localHeader())
+        self.fp.seek(end)
+        self.entries.append(entry)
+
+    def writeDirectory(self, name):
+        entry = ZipEntry(name, (1980, 1, 1, 0, 0, 0), 0777 << 16L, zipfile.ZIP_STORED, 0, 0)
+        entry.offset = self.fp.tell()
+        self.fp.write(entry.localHeader())
+        self.entries.append(entry)
+
+    def close(self):
+        """ writes the central directory, with the zip64 records if it doesn't fit the classic end record """
+        start = self.fp.tell()
+        for entry in self.entries:
+            self.fp.write(entry.centralHeader())
+        count, size = len(self.entries), self.fp.tell() - start
+        if count >= zipfile.ZIP_FILECOUNT_LIMIT or start > zipfile.ZIP64_LIMIT or size > zipfile.ZIP64_LIMIT:
+            zip64End = self.fp.tell()
+            self.fp.write(ZIP64_END_RECORD.pack('PK\006\006', ZIP64_END_RECORD.size - 12, 45, 45, 0, 0, count, count, size, start))
+            self.fp.write(ZIP64_LOCATOR.pack('PK\006\007', 0, zip64End, 1))
+            count, size, start = min(count, 0xffff), min(size, 0xffffffff), min(start, 0xffffffff)
+        self.fp.write(END_RECORD.pack('PK\005\006', 0, 0, count, count, size, start, 0))
+
+class ArchiveStats(object):
+
+    def __init__(self):
+        self.files = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.seconds = 0.0
+
+    def throughput(self):
+        """ uncompressed bytes per second """
+        if self.seconds <= 0:
+            return 0.0
+        return self.bytesIn / self.seconds
+
+class Archiver(object):
+    """ writes zip archives, deflating entries in parallel. Files which are
+        compressed already are stored as they are """
+
+    def __init__(self, workers=None):
+        self.workers = workers or cpu_count()
+
+    def archive(self, fileObj, entries, emptyDirs=()):
+        """ write entries, a list of (filePath, archiveName), and emptyDirs to a zip in fileObj.
+            Entries keep their order in the archive. Returns an ArchiveStats """
+        stats = ArchiveStats()
+        start = time.time()
+        zipFile = ZipWriter(fileObj)
+        pool = ThreadPool(self.workers)
+        pending = deque()
+        try:
+            for filePath, archiveName in entries:
+                if isCompressed(filePath):
+                    job = None
+                else:
+                    job = pool.apply_async(deflateFile, (filePath,))
+                pending.append((filePath, archiveName, job))
+                # bound the number of finished but unwritten entries
+                while len(pending) > self.workers * 2:
+                    self._writeEntry(zipFile, pending.popleft(), stats)
+            while pending:
+                self._writeEntry(zipFile, pending.popleft(), stats)
+        finally:
+            pool.close()
+            pool.join()
+
+        for archiveName in emptyDirs:
+            zipFile.writeDirectory(archiveName.replace(os.sep, '/'))
+
+        zipFile.close()
+        stats.bytesOut = fileObj.tell()
+        stats.seconds = time.time() - start
+        return stats
+
+    def _writeEntry(self, zipFile, entry, stats):
+        filePath, archiveName, job = entry
+        stats.files += 1
+        st = os.stat(filePath)
+        # as zipfile names its members
+        archiveName = os.path.normpath(os.path.splitdrive(archiveName)[1]).lstrip(os.sep).replace(os.sep, '/')
+        dateTime = time.localtime(st.st_mtime)[0:6]
+        externalAttr = (st.st_mode & 0xFFFF) << 16L
+        if job is None:
+            zipEntry = ZipEntry(archiveName, dateTime, externalAttr, zipfile.ZIP_STORED, st.st_size, st.st_size)
+            zipFile.writeStored(zipEntry, filePath)
+            stats.bytesIn += zipEntry.fileSize
+            return
+
+        crc, fileSize, spool = job.get()
+        try:
+            zipEntry = ZipEntry(archiveName, dateTime, externalAttr, zipfile.ZIP_DEFLATED, fileSize, spool.tell(), crc)
+            zipFile.writeDeflated(zipEntry, spool)
+        finally:
+            spool.close()
+        stats.bytesIn += fileSize
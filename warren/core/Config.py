@@ -1,18 +1,30 @@
 import sys, os, os.path
 from configobj import ConfigObj
 
-CONFIG_DEFAULTS = {'node' : {'host':'127.0.0.1','fcp_port':9481, 'fproxy_port':8888, 'fproxy_ssl':False},
+CONFIG_DEFAULTS = {'node' : {'host':'127.0.0.1','fcp_port':9481, 'fproxy_port':8888, 'fproxy_ssl':False,
+                             'fcp_connections':3},
                    'proxy' : {'http':{'host':'','port':8118}},
                    'warren' : {'file_keytype':'SSK@', 'pastebin_keytype':'SSK@',
                                'browser_command' : '',
                                'max_clipboard_keys' : 5,
                                'start_on_top' : False,
                                'last_window_pos' : ['0','0'],
-                               'show_file_dropped_dialog':True},
+                               'show_file_dropped_dialog':True,
+                               'insert_workers' : 2,
+                               'insert_max_inflight_mb' : 64,
+                               'key_first' : True,
+                               'metrics_interval' : 60,
+                               'metrics_port' : 0,
+                               'paste_compact' : True},
+                   # FCP PriorityClass from 0 (maximum) to 6 (minimum), see PriorityPolicy
+                   'priorities' : {'paste' : 2, 'paste_realtime' : True,
+                                   'small_kb' : 512, 'small_insert' : 2, 'small_realtime' : True,
+                                   'insert' : 4,
+                                   'bulk_mb' : 64, 'bulk_insert' : 5,
+                                   'download' : 4,
+                                   'queue_depth' : 20},
                    }
 
-#TODO options for priorities, separate for pastebin and file inserts
-
 class Config(ConfigObj):
 
     def __init__(self):
@@ -25,6 +37,7 @@ class Config(ConfigObj):
             dirname = ".warren"
 
         filepath = os.path.join(os.path.expanduser("~"),dirname)
+        self.configDir = filepath
         self.filename = os.path.join(filepath,"settings.cfg")
         if not os.path.exists(filepath):
             os.makedirs(filepath)
@@ -0,0 +1,77 @@
+import threading, time
+
+DDA_VERDICT_TTL = 600 # seconds a TestDDA verdict is trusted
+DDA_TEST_TIMEOUT = 5
+DDA_REPLY_TIMEOUT = 5 # upper limit to wait for the node's answer to a disk put
+
+class DDACache(object):
+    """ remembers the node's TestDDA verdicts per directory, so only the
+        first insert or download of a directory pays for the round-trip.
+        Has to be invalidated whenever the node connection is (re)established """
+
+    def __init__(self, ttl=DDA_VERDICT_TTL):
+        self.ttl = ttl
+        self.verdicts = {}
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        with self.lock:
+            self.verdicts.clear()
+
+    def set(self, directory, mode, allowed):
+        with self.lock:
+            self.verdicts[(directory, mode)] = (allowed, time.time())
+
+    def get(self, directory, mode):
+        with self.lock:
+            verdict = self.verdicts.get((directory, mode))
+        if verdict is None or time.time() - verdict[1] > self.ttl:
+            return None
+        return verdict[0]
+
+    def canRead(self, node, directory):
+        return self._allowed(node, directory, 'read')
+
+    def canWrite(self, node, directory):
+        return self._allowed(node, directory, 'write')
+
+    def _allowed(self, node, directory, mode):
+        allowed = self.get(directory, mode)
+        if allowed is not None:
+            return allowed
+
+        try:
+            if mode == 'read':
+                result = node.testDDA(async=False, Directory=directory, WantReadDirectory=True, timeout=DDA_TEST_TIMEOUT)
+                allowed = result.get('header') == 'TestDDAComplete' and result.get('ReadDirectoryAllowed') == 'true'
+            else:
+                result = node.testDDA(async=False, Directory=directory, WantWriteDirectory=True, timeout=DDA_TEST_TIMEOUT)
+                allowed = result.get('header') == 'TestDDAComplete' and result.get('WriteDirectoryAllowed') == 'true'
+        except Exception, e:
+            return False # don't remember timeouts and broken connections
+
+        self.set(directory, mode, allowed)
+        return allowed
+
+class NodeReply(object):
+    """ request callback which lets a thread wait for the node's first
+        answer instead of sleeping a fixed time. Messages are passed on to callback """
+
+    def __init__(self, callback=None):
+        self.event = threading.Event()
+        self.status = None
+        self.message = None
+        self.forward = callback
+
+    def callback(self, status, message):
+        if self.status is None or self.status == 'pending':
+            self.status = status
+            self.message = message
+        self.event.set()
+        if self.forward:
+            self.forward(status, message)
+
+    def wait(self, timeout):
+        """ returns 'pending', 'successful', 'failed' or None if the node didn't answer in time """
+        self.event.wait(timeout)
+        return self.status
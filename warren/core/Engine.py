@@ -0,0 +1,353 @@
+import FileManager
+from FCPPool import FCPPool
+from FCPClient import FCPError
+from DDA import DDACache
+from InsertScheduler import InsertScheduler
+from KeyIndex import KeyIndex
+from Journal import InsertJournal
+from NodeProfile import NodeProfile, NodeProfileCache
+from ProgressTable import ProgressTable
+from Metrics import Metrics, MetricsLog, MetricsServer
+from PriorityPolicy import PriorityPolicy
+import os.path, random, threading, time, socket
+
+RECONNECT_MIN_DELAY = 0.5 # seconds, doubled after every failed attempt
+RECONNECT_MAX_DELAY = 60
+KEEPALIVE_AFTER = 60 # seconds without traffic before the watchdog writes to the node
+PROGRESS_INTERVAL = 1 # seconds between two progress updates of the UI
+REBALANCE_INTERVAL = 30 # seconds between two checks of the running requests' priorities
+# the node is done with the request, its priority isn't rebalanced any more
+DONE_MESSAGES = ('PutSuccessful', 'PutFailed', 'DataFound', 'GetFailed', 'PersistentRequestRemoved')
+
+class Engine(object):
+    """ everything warren does with the node, without Qt. The GUI's NodeManager and the
+        command line client subclass it and override the hooks at the end of the class,
+        which are called from worker and FCP threads """
+
+    role = 'engine' # part of the FCP client name, see clientName
+    rebalanceInterval = REBALANCE_INTERVAL
+
+    def __init__(self, config):
+        self.config = config
+        self.node = None
+        self.pool = None
+        self.connected = None
+        self.connectedEvent = threading.Event()
+        self.watchdog = None
+        self.profile = None
+        self.profiles = NodeProfileCache(os.path.join(self.config.configDir, 'nodeprofiles'))
+        self.profilesChecked = set() # (host, port) of the nodes whose config was asked for in this session
+        self.dda = DDACache()
+        self.keyIndex = KeyIndex(os.path.join(self.config.configDir, 'keyindex'))
+        self.journal = InsertJournal(os.path.join(self.config.configDir, 'journal'))
+        self.activeInserts = set()
+        self.insertLock = threading.Lock() # a new insert isn't taken for one to resume
+        self.progress = ProgressTable()
+        self.progressShown = 0
+        self.priorities = PriorityPolicy(self.config['priorities'])
+        self.rebalanced = 0
+        self.startMetrics()
+        self.insertScheduler = InsertScheduler(workers=int(self.config['warren']['insert_workers']),
+                                               maxBytesInFlight=int(self.config['warren']['insert_max_inflight_mb'])*1024*1024)
+
+    def startWatchdog(self):
+        """ connects the node in the background and keeps it connected """
+        self.watchdog = NodeWatchdog(self)
+
+    def waitConnected(self, timeout=None):
+        self.connectedEvent.wait(timeout)
+        return self.connectedEvent.isSet()
+
+    def startMetrics(self):
+        """ metrics are written to configDir/metrics.log every metrics_interval seconds and served
+            on http://127.0.0.1:metrics_port/metrics, a value of 0 turns them off """
+        self.metrics = Metrics()
+        self.metricsLog = None
+        self.metricsServer = None
+        interval = int(self.config['warren']['metrics_interval'])
+        port = int(self.config['warren']['metrics_port'])
+        if interval > 0:
+            self.metricsLog = MetricsLog(self.metrics, os.path.join(self.config.configDir, 'metrics.log'), interval)
+        if port > 0:
+            try:
+                self.metricsServer = MetricsServer(self.metrics, port)
+            except socket.error, e:
+                pass # port in use, run without
+
+    def connectNode(self):
+        """ returns True if the node is connected now """
+        self.dda.invalidate()
+        started = time.time()
+        try:
+            self.pool = FCPPool(self.clientName(),host=self.config['node']['host'],port=int(self.config['node']['fcp_port']),
+                                size=int(self.config['node']['fcp_connections']))
+            self.node = self.pool.control
+            self.updateNodeConfigValues()
+        except Exception, e:
+            self.metrics.count('warren_connect_failures_total')
+            self.disconnectNode()
+            return False
+        self.metrics.count('warren_connects_total')
+        self.metrics.since('warren_connect_seconds', started)
+        self.node.addCloseHandler(self.connectionLost)
+        self.pool.addWatcher(self.queueMessage)
+        try:
+            self.node.watchGlobal(True)
+        except Exception, e:
+            pass # the close handler takes care of it
+        self.setConnected(True)
+        self.resumeInserts()
+        return True
+
+    def clientName(self):
+        """ the node drops a connection when another one uses its name, so the GUI and
+            command line clients running at the same time need their own names """
+        return 'Warren-%s-%d' % (self.role, os.getpid())
+
+    def disconnectNode(self):
+        if self.connected:
+            self.metrics.count('warren_disconnects_total')
+        pool = self.pool
+        self.pool = None
+        self.node = None
+        if pool:
+            pool.shutdown()
+        self.progress.clear()
+        self.setConnected(False)
+
+    def setConnected(self, connected):
+        if connected == self.connected:
+            return
+        self.connected = connected
+        if connected:
+            self.connectedEvent.set()
+        else:
+            self.connectedEvent.clear()
+        self.nodeStateChanged(connected)
+
+    def insertPriority(self, identifier, size):
+        """ returns (PriorityClass, realtime) for an insert """
+        return self.priorities.forInsert(identifier, size, self.progress.depth())
+
+    def rebalance(self):
+        """ promote running requests which are about to finish, called by the watchdog """
+        self.rebalanced = time.time()
+        node = self.node
+        for identifier, priority in self.priorities.rebalance(self.progress.running()):
+            try:
+                node.send('ModifyPersistentRequest', {'Identifier':identifier, 'Global':True, 'PriorityClass':priority})
+            except Exception, e:
+                return
+
+    def queueMessage(self, message):
+        """ watcher of the global queue, called from the FCP reader threads """
+        if message['header'] in DONE_MESSAGES:
+            self.priorities.release(message.get('Identifier'))
+        if not self.progress.message(message):
+            return
+        # progress is reported once a second, finished requests at once
+        if message['header'] == 'SimpleProgress' and time.time() - self.progressShown < PROGRESS_INTERVAL:
+            return
+        self.progressShown = time.time()
+        self.queueProgressChanged(self.progress.summary())
+
+    def connectionLost(self, client):
+        """ called from the FCP reader thread as soon as the control connection is gone """
+        if client is self.node and self.watchdog:
+            self.watchdog.wake()
+
+    def dataNode(self, length):
+        """ connection for a payload of length bytes, large ones don't share the control connection """
+        pool = self.pool
+        if pool is None:
+            return self.node
+        return pool.forData(length)
+
+    def updateNodeConfigValues(self):
+        """ use the stored profile of the node if it wasn't updated since, it is checked in the background
+            once per session. Only the first connect to a node or to a new build waits for its config """
+        host, port, node = self.config['node']['host'], int(self.config['node']['fcp_port']), self.node
+        profile = self.profiles.get(host, port, node.nodeHello)
+        if profile is None:
+            self.profile = NodeProfile.fromConfig(node.getconfig(async=False, WithCurrent=True), node.nodeHello)
+            self.profiles.store(host, port, self.profile)
+            self.profilesChecked.add((host, port))
+            return
+
+        self.profile = profile
+        if (host, port) in self.profilesChecked:
+            return
+        self.profilesChecked.add((host, port))
+        def checkProfile(status, nconfig):
+            if status != 'successful':
+                return
+            try:
+                current = NodeProfile.fromConfig(nconfig, node.nodeHello)
+            except KeyError, e:
+                return
+            if self.node is node:
+                self.profile = current
+            if not current.sameConfig(profile):
+                self.profiles.store(host, port, current)
+        node.getconfig(async=True, callback=checkProfile, WithCurrent=True)
+
+    def putKeyOnQueue(self, key):
+        return self.putKeysOnQueue([key])[0][1]
+
+    def putKeysOnQueue(self, keys):
+        """ puts downloads of all keys on the node's global queue. Whether the node may write to
+            its download dir is decided once, the requests are sent back to back without waiting
+            for the node. Returns a list of (key, error message or None) """
+        node = self.node
+        if node is None:
+            return [(key, 'Node not connected') for key in keys]
+        testDDAResult = self.profile.downloadToDisk()
+        if testDDAResult is None:
+            testDDAResult = self.dda.canWrite(node, self.profile.downloadsDir)
+
+        results = []
+        depth = self.progress.depth()
+        seen = set()
+        names = set()
+        for key in keys:
+            if key in seen:
+                continue # listed twice
+            name = key.split('/')[-1]
+            if name in names:
+                results.append((key, 'Duplicate file name %s' % name))
+                continue
+            seen.add(key)
+            names.add(name)
+            filename = testDDAResult and os.path.join(self.profile.downloadsDir, name) or None
+            try:
+                priority = self.priorities.forDownload('Warren:'+name, len(keys), depth)
+                node.get(key,async=True, Global=True, persistence='forever',priority=priority, id='Warren:'+name, file=filename)
+            except FCPError, e:
+                results.append((key, str(e)))
+                continue
+            results.append((key, None))
+        return results
+
+    def insertFiles(self, items):
+        """ items is a list of (url, content-type). Several items are inserted as one manifest.
+            Returns the insert job """
+        with self.insertLock:
+            return self.submitInsert(self.journal.add(items), items)
+
+    def insertFile(self, url, mimeType):
+        return self.insertFiles([(url, mimeType)])
+
+    def submitInsert(self, journalId, items):
+        if len(items) > 1:
+            fileInsert = FileManager.ManifestInsert(self, items, proxy=self.config['proxy']['http'])
+        elif items[0][1] == 'directory':
+            fileInsert = FileManager.DirectoryInsert(self, items[0][0])
+        else:
+            fileInsert = FileManager.FileInsert(self, items[0][0], items[0][1], proxy=self.config['proxy']['http'])
+        fileInsert.journalId = journalId
+        fileInsert.items = items
+        self.activeInserts.add(journalId)
+        self.insertScheduler.submit(fileInsert)
+        return fileInsert
+
+    def resumeInserts(self):
+        """ submit the inserts which didn't reach the node before a crash or disconnect """
+        with self.insertLock:
+            for journalId, entry in self.journal.unfinished(exclude=set(self.activeInserts)):
+                items = [(url.encode('utf-8'), mimeType.encode('utf-8')) for url, mimeType in entry['items']]
+                self.journal.update(journalId, state='queued', attempts=entry['attempts']+1)
+                self.submitInsert(journalId, items)
+
+    def stop(self):
+        self.insertScheduler.stop()
+        if self.watchdog:
+            self.watchdog.stop()
+        pool = self.pool
+        self.pool = None
+        self.node = None
+        if pool:
+            pool.shutdown()
+        if self.metricsServer:
+            self.metricsServer.stop()
+        if self.metricsLog:
+            self.metricsLog.stop()
+
+    # --- hooks
+
+    def nodeStateChanged(self, connected):
+        pass
+
+    def queueProgressChanged(self, summary):
+        """ summary is ProgressTable.summary() """
+        pass
+
+    def insertDone(self, fileInsert):
+        """ called from the insert workers, whatever happened to the insert """
+        self.activeInserts.discard(fileInsert.journalId)
+
+    def insertKeyKnown(self, key, fileInsert):
+        """ called from insert jobs when the content was inserted before """
+        pass
+
+    def insertKeyGenerated(self, key, fileInsert):
+        """ called as soon as the node generated the key, long before the insert is finished """
+        pass
+
+    def insertCompleted(self, fileInsert, status, message):
+        """ the node finished the insert, status is 'successful' or 'failed'. Only called while
+            the connection which sent the insert is still open """
+        pass
+
+class NodeWatchdog(threading.Thread):
+    """ (re)connects the node. The FCP reader notices a closed connection at once and wakes
+        the watchdog, which reconnects with exponential backoff and jitter. An idle connection
+        only gets a keepalive message after KEEPALIVE_AFTER seconds without traffic. While
+        connected it rebalances the priorities of the running requests """
+
+    def __init__(self, engine):
+        threading.Thread.__init__(self, name='WarrenWatchdog')
+        self.daemon = True
+        self.engine = engine
+        self.event = threading.Event()
+        self.running = True
+        self.start()
+
+    def wake(self):
+        self.event.set()
+
+    def stop(self):
+        self.running = False
+        self.event.set()
+
+    def run(self):
+        delay = RECONNECT_MIN_DELAY
+        while self.running:
+            if not self.engine.connectNode():
+                # half of the delay fixed, half random, so several clients don't retry in lockstep
+                self.pause(delay/2 + random.uniform(0, delay/2))
+                delay = min(delay*2, RECONNECT_MAX_DELAY)
+                continue
+            delay = RECONNECT_MIN_DELAY
+            self.watch(self.engine.node)
+            if self.running:
+                self.engine.disconnectNode()
+
+    def watch(self, node):
+        """ returns when the connection is lost or the watchdog is stopped """
+        engine = self.engine
+        while self.running and node.running:
+            untilRebalance = engine.rebalanced + engine.rebalanceInterval - time.time()
+            self.pause(max(0, min(KEEPALIVE_AFTER - node.idleTime(), untilRebalance)))
+            if not (self.running and node.running):
+                return
+            if time.time() - engine.rebalanced >= engine.rebalanceInterval:
+                engine.rebalance()
+            if node.idleTime() >= KEEPALIVE_AFTER:
+                try:
+                    node.keepAlive()
+                except Exception, e:
+                    return
+
+    def pause(self, seconds):
+        self.event.wait(seconds)
+        self.event.clear()
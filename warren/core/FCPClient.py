@@ -0,0 +1,435 @@
+import socket, threading, itertools, time
+import Queue
+import os, os.path
+from Streaming import StreamPayload
+
+FCP_VERSION = '2.0'
+CONNECT_TIMEOUT = 10
+SHUTDOWN_TIMEOUT = 10 # seconds to send the queued messages before the connection is closed
+# TCP keepalive: probe an idle connection after KEEPALIVE_IDLE seconds, give up after KEEPALIVE_COUNT unanswered probes
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+
+VERBOSITY_PROGRESS = 1 # the node sends SimpleProgress messages
+# requests on the global queue, the progress table needs their SimpleProgress
+GLOBAL_REQUESTS = frozenset(['ClientPut', 'ClientGet', 'ClientPutComplexDir', 'ClientPutDiskDir'])
+
+# requests are finished with these messages
+SUCCESS_MESSAGES = frozenset(['PutSuccessful', 'DataFound', 'AllData', 'ConfigData'])
+FAILURE_MESSAGES = frozenset(['PutFailed', 'GetFailed', 'ProtocolError', 'IdentifierCollision', 'PersistentRequestRemoved'])
+
+class FCPError(Exception):
+
+    def __init__(self, message):
+        Exception.__init__(self, message.get('CodeDescription', message.get('header')))
+        self.message = message
+
+class JobTicket(object):
+    """ a request on the node. callback(status, message) gets 'pending' for every message
+        of the request until it finishes with 'successful' or 'failed' """
+
+    def __init__(self, identifier, msgType, callback=None):
+        self.id = identifier
+        self.cmd = msgType
+        self.callback = callback
+        self.result = None
+        self.failed = False
+        self.sent = threading.Event()
+        self.done = threading.Event()
+
+    def isComplete(self):
+        return self.done.isSet()
+
+    def waitTillReqSent(self, timeout=None):
+        self.sent.wait(timeout)
+        return self.sent.isSet()
+
+    def wait(self, timeout=None):
+        """ returns the final message of the request, raises FCPError if it failed or didn't finish in time """
+        self.done.wait(timeout)
+        if not self.done.isSet():
+            raise FCPError({'header':'Timeout', 'CodeDescription':'No answer from node in time'})
+        if self.failed:
+            raise FCPError(self.result)
+        return self.result
+
+    def _message(self, message):
+        header = message['header']
+        if header in SUCCESS_MESSAGES:
+            status = 'successful'
+        elif header in FAILURE_MESSAGES:
+            status = 'failed'
+        else:
+            status = 'pending'
+        if status != 'pending':
+            self.result = message
+            self.failed = status == 'failed'
+        if self.callback:
+            try:
+                self.callback(status, message)
+            except Exception, e:
+                pass # a broken callback must not kill the connection
+        if status != 'pending':
+            self.done.set()
+        return status != 'pending'
+
+class FCPClient(object):
+    """ FCP 2.0 client. All requests are multiplexed over one connection by their Identifier:
+        a reader thread dispatches the node's messages to the JobTickets, a writer thread sends
+        queued messages, so callers only block if they ask for it """
+
+    def __init__(self, name, host='127.0.0.1', port=9481):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.jobs = {}
+        self.ddaTests = {}
+        self.watchers = []
+        self.closeHandlers = []
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.outgoing = Queue.Queue()
+        self.queuedBytes = 0 # payload bytes waiting to be sent
+        self.running = False
+        self.nodeIsAlive = False
+        self.lastActivity = time.time()
+
+        self.socket = socket.create_connection((host, port), CONNECT_TIMEOUT)
+        self.socket.settimeout(None)
+        self._enableKeepalive()
+        self.reader = self.socket.makefile('rb')
+        self._send(self._encode('ClientHello', {'Name':name, 'ExpectedVersion':FCP_VERSION}))
+        self.socket.settimeout(CONNECT_TIMEOUT)
+        self.nodeHello = self._receive()
+        self.socket.settimeout(None)
+        if self.nodeHello is None or self.nodeHello['header'] != 'NodeHello':
+            self.socket.close()
+            raise FCPError(self.nodeHello or {'header':'NodeHello', 'CodeDescription':'No NodeHello from node'})
+
+        self.running = True
+        self.nodeIsAlive = True
+        for target, name in ((self._readLoop, 'FCPReader'), (self._writeLoop, 'FCPWriter')):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+        self.writer = thread
+
+    # --- requests
+
+    def put(self, uri='CHK@', data=None, file=None, async=True, name=None, persistence='connection', Global=False,
+            id=None, mimetype=None, waituntilsent=False, priority=3, realtime=False, chkonly=False, callback=None,
+            Verbosity=0, timeout=None):
+        fields = {'URI':uri, 'Verbosity':Verbosity, 'MaxRetries':-1, 'PriorityClass':priority,
+                  'Persistence':persistence, 'Global':Global, 'GetCHKOnly':chkonly, 'RealTimeFlag':realtime}
+        if name:
+            fields['TargetFilename'] = name
+        if mimetype:
+            fields['Metadata.ContentType'] = mimetype
+        if file is not None:
+            fields['UploadFrom'] = 'disk'
+            fields['Filename'] = os.path.abspath(file)
+        else:
+            fields['UploadFrom'] = 'direct'
+        return self.submit(id, 'ClientPut', fields, data=data, callback=callback, async=async,
+                           waituntilsent=waituntilsent, timeout=timeout)
+
+    def get(self, uri, async=True, Global=False, persistence='connection', priority=3, id=None, file=None,
+            realtime=False, callback=None, waituntilsent=False, timeout=None):
+        fields = {'URI':uri, 'Verbosity':0, 'MaxRetries':-1, 'PriorityClass':priority,
+                  'Persistence':persistence, 'Global':Global, 'RealTimeFlag':realtime}
+        if file is not None:
+            fields['ReturnType'] = 'disk'
+            fields['Filename'] = os.path.abspath(file)
+        else:
+            fields['ReturnType'] = 'direct'
+        return self.submit(id, 'ClientGet', fields, callback=callback, async=async,
+                           waituntilsent=waituntilsent, timeout=timeout)
+
+    def getconfig(self, async=False, timeout=None, callback=None, **fields):
+        return self.submit(None, 'GetConfig', fields, callback=callback, async=async, timeout=timeout)
+
+    def watchGlobal(self, enabled=True, verbosityMask=1):
+        """ subscribe to the messages of all requests on the global queue, they are passed to the watchers """
+        self.send('WatchGlobal', {'Enabled':enabled, 'VerbosityMask':verbosityMask})
+
+    def addWatcher(self, callback):
+        """ callback(message) gets every message with an Identifier, including those of this connection's requests """
+        self.watchers.append(callback)
+
+    def deliver(self, message):
+        """ pass a message to the JobTicket of its Identifier, returns False if this connection has none """
+        identifier = message.get('Identifier')
+        with self.lock:
+            job = self.jobs.get(identifier)
+        if job is None:
+            return False
+        if job._message(message):
+            with self.lock:
+                if self.jobs.get(identifier) is job:
+                    del self.jobs[identifier]
+        return True
+
+    def testDDA(self, async=False, Directory=None, WantReadDirectory=False, WantWriteDirectory=False, timeout=None):
+        """ TestDDA has no Identifier, the test is tracked by its directory instead.
+            Returns the TestDDAComplete message """
+        with self.lock:
+            # the node runs one test per directory, a running test which covers ours is shared
+            job = self.ddaTests.get(Directory)
+            send = job is None or (WantReadDirectory and not job.wantRead) or (WantWriteDirectory and not job.wantWrite)
+            if send:
+                job = JobTicket(Directory, 'TestDDARequest')
+                job.wantRead, job.wantWrite = WantReadDirectory, WantWriteDirectory
+                self.ddaTests[Directory] = job
+        if send:
+            self.send('TestDDARequest', {'Directory':Directory,
+                                         'WantReadDirectory':WantReadDirectory,
+                                         'WantWriteDirectory':WantWriteDirectory})
+        if async:
+            return job
+        try:
+            return job.wait(timeout)
+        finally:
+            with self.lock:
+                if self.ddaTests.get(Directory) is job:
+                    del self.ddaTests[Directory]
+
+    def submit(self, identifier, msgType, fields, data=None, callback=None, async=True, waituntilsent=False, timeout=None):
+        """ send a request message, its answers go to the returned JobTicket """
+        if not self.running:
+            raise FCPError({'header':'ConnectionLost', 'CodeDescription':'Not connected to node'})
+        if identifier is None:
+            identifier = 'warren-%s-%d' % (self.name, self.counter.next())
+        fields = dict(fields)
+        fields['Identifier'] = identifier
+        if msgType in GLOBAL_REQUESTS and fields.get('Global'):
+            fields['Verbosity'] = int(fields.get('Verbosity', 0)) | VERBOSITY_PROGRESS
+        job = JobTicket(identifier, msgType, callback)
+        with self.lock:
+            self.jobs[identifier] = job
+            if data is not None:
+                self.queuedBytes += len(data)
+        self.outgoing.put((self._encode(msgType, fields, data), data, job))
+        if async:
+            if waituntilsent:
+                job.waitTillReqSent()
+                if job.failed and not self.running:
+                    raise FCPError(job.result)
+            return job
+        return job.wait(timeout)
+
+    def send(self, msgType, fields=None):
+        """ send a message which isn't tracked """
+        if not self.running:
+            raise FCPError({'header':'ConnectionLost', 'CodeDescription':'Not connected to node'})
+        self.outgoing.put((self._encode(msgType, fields or {}), None, None))
+
+    def addCloseHandler(self, callback):
+        """ callback(client) is called once, from a connection thread, when the connection is closed or lost """
+        with self.lock:
+            if self.running:
+                self.closeHandlers.append(callback)
+                return
+        callback(self)
+
+    def idleTime(self):
+        """ seconds since anything was sent or received """
+        return time.time() - self.lastActivity
+
+    def keepAlive(self):
+        # there is no ping in FCP, but writing to a dead connection fails
+        self.send('Void')
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """ returns when the messages queued before are sent, e.g. the ClientGets of a command
+            line client which exits right after, or after timeout seconds """
+        if self.running:
+            try:
+                self.send('Disconnect')
+            except FCPError, e:
+                pass
+        self.outgoing.put(None)
+        if self.writer is not None and self.writer is not threading.current_thread():
+            self.writer.join(timeout)
+
+    # --- connection
+
+    def _encode(self, msgType, fields, data=None):
+        lines = [msgType]
+        for key, value in fields.items():
+            if isinstance(value, bool):
+                value = value and 'true' or 'false'
+            elif isinstance(value, unicode):
+                value = value.encode('utf-8')
+            lines.append('%s=%s' % (key, value))
+        if data is None:
+            lines.append('EndMessage')
+        else:
+            if msgType != 'ClientPutComplexDir': # the files of a manifest carry their own DataLength
+                lines.append('DataLength=%d' % len(data))
+            lines.append('Data')
+        return '\n'.join(lines) + '\n'
+
+    def _enableKeepalive(self):
+        """ let the OS notice a dead peer on an idle connection, e.g. a node on another machine """
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                              ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+            if hasattr(socket, option): # linux only
+                try:
+                    self.socket.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+                except socket.error, e:
+                    pass
+
+    def _send(self, raw):
+        self.socket.sendall(raw)
+        self.lastActivity = time.time()
+
+    def _writeLoop(self):
+        stop = False
+        while not stop:
+            item = self.outgoing.get()
+            if item is None or not self.running:
+                break
+            raw, data, job = item
+            parts, jobs = [raw], [job]
+            # send the queued messages in one go, up to the first one with data
+            while data is None:
+                try:
+                    item = self.outgoing.get_nowait()
+                except Queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                raw, data, job = item
+                parts.append(raw)
+                jobs.append(job)
+            try:
+                self._send(''.join(parts))
+                if isinstance(data, StreamPayload):
+                    try:
+                        data.sendTo(self.socket)
+                    finally:
+                        data.close()
+                elif data is not None:
+                    self._send(data)
+            except (socket.error, IOError), e:
+                self._connectionLost()
+                break
+            finally:
+                if data is not None:
+                    with self.lock:
+                        self.queuedBytes -= len(data)
+            for job in jobs:
+                if job:
+                    job.sent.set()
+        self._close()
+
+    def _receive(self):
+        """ read one message, returns None if the connection is closed """
+        message = {}
+        while True:
+            line = self.reader.readline()
+            if not line:
+                return None
+            line = line.rstrip('\r\n')
+            if not message:
+                if line:
+                    message['header'] = line
+                continue
+            if line == 'EndMessage':
+                self.lastActivity = time.time()
+                return message
+            if line == 'Data':
+                message['Data'] = self.reader.read(int(message.get('DataLength', 0)))
+                self.lastActivity = time.time()
+                return message
+            key, sep, value = line.partition('=')
+            message[key] = value
+
+    def _readLoop(self):
+        while self.running:
+            try:
+                message = self._receive()
+            except (socket.error, IOError, ValueError), e:
+                message = None
+            if message is None:
+                self._connectionLost()
+                return
+            self._dispatch(message)
+
+    def _dispatch(self, message):
+        header = message['header']
+        if header in ('TestDDAReply', 'TestDDAComplete'):
+            self._ddaMessage(message)
+            return
+        if header == 'CloseConnectionDuplicateClientName':
+            self._connectionLost()
+            return
+
+        self.deliver(message)
+        for watcher in self.watchers:
+            try:
+                watcher(message)
+            except Exception, e:
+                pass
+
+    def _ddaMessage(self, message):
+        directory = message.get('Directory')
+        with self.lock:
+            job = self.ddaTests.get(directory)
+        if job is None:
+            return
+        if message['header'] == 'TestDDAComplete':
+            with self.lock:
+                if self.ddaTests.get(directory) is job:
+                    del self.ddaTests[directory]
+            job.result = message
+            job.done.set()
+            return
+
+        # prove to the node that we see the same files
+        response = {'Directory':directory}
+        try:
+            if 'ReadFilename' in message:
+                with open(message['ReadFilename'], 'rb') as f:
+                    response['ReadContent'] = f.read()
+            if 'WriteFilename' in message and 'ContentToWrite' in message:
+                with open(message['WriteFilename'], 'wb') as f:
+                    f.write(message['ContentToWrite'])
+        except IOError, e:
+            pass # the node will deny access
+        try:
+            self.send('TestDDAResponse', response)
+        except FCPError, e:
+            pass
+
+    def _connectionLost(self):
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+            self.nodeIsAlive = False
+            jobs = self.jobs.values() + self.ddaTests.values()
+            self.jobs.clear()
+            self.ddaTests.clear()
+            handlers = self.closeHandlers
+            self.closeHandlers = []
+        self.outgoing.put(None)
+        for job in jobs:
+            job._message({'header':'ProtocolError', 'CodeDescription':'Connection to node lost', 'Fatal':'true'})
+            job.sent.set() # nobody waits for a dead connection
+        self._close()
+        for handler in handlers:
+            try:
+                handler(self)
+            except Exception, e:
+                pass
+
+    def _close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error, e:
+            pass
+        self.socket.close()
@@ -0,0 +1,69 @@
+import threading, itertools
+from FCPClient import FCPClient
+
+SMALL_PAYLOAD = 256*1024 # payloads up to this size stay on the control connection
+
+class FCPPool(object):
+    """ one control connection for pings, config, TestDDA and small requests, plus
+        up to size-1 data connections for large payloads, so a big insert doesn't
+        hold back everything else. Data connections are opened on first use.
+        The node sends the messages of global requests to the connections which watch
+        the global queue, only the control connection does, see route """
+
+    def __init__(self, name, host='127.0.0.1', port=9481, size=3):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.size = max(1, size)
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.dataClients = []
+        self.watchers = []
+        self.control = FCPClient(name, host=host, port=port)
+        self.control.addWatcher(self.route)
+
+    def route(self, message):
+        """ passes a message of the global queue to the data connection which sent the request """
+        with self.lock:
+            clients = list(self.dataClients)
+        for client in clients:
+            if client.deliver(message):
+                return
+
+    def addWatcher(self, callback):
+        """ callback(message) gets the messages of all connections, see FCPClient.addWatcher """
+        with self.lock:
+            self.watchers.append(callback)
+            clients = [self.control] + self.dataClients
+        for client in clients:
+            client.addWatcher(callback)
+
+    def forData(self, length):
+        """ returns the connection to send a payload of length bytes on """
+        if length <= SMALL_PAYLOAD or self.size < 2:
+            return self.control
+        with self.lock:
+            self.dataClients = [client for client in self.dataClients if client.running]
+            idle = [client for client in self.dataClients if not client.queuedBytes]
+            if idle:
+                return idle[0]
+            if len(self.dataClients) < self.size - 1:
+                try:
+                    client = FCPClient('%s-data-%d' % (self.name, self.counter.next()), host=self.host, port=self.port)
+                except Exception, e:
+                    client = None
+                if client is not None:
+                    for watcher in self.watchers:
+                        client.addWatcher(watcher)
+                    self.dataClients.append(client)
+                    return client
+            if not self.dataClients:
+                return self.control
+            return min(self.dataClients, key=lambda client: client.queuedBytes)
+
+    def shutdown(self):
+        with self.lock:
+            clients = self.dataClients
+            self.dataClients = []
+        for client in clients + [self.control]:
+            client.shutdown()
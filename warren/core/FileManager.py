@@ -1,58 +1,243 @@
-from PyQt4.QtCore import QThread
-import urllib2, zipfile
-import os.path
-from StringIO import StringIO
+import urllib2, httplib, mimetypes
+import os.path, tempfile, time, threading, socket, errno
+from Streaming import openPayload, StreamPayload, FilePayload, MultiPayload, SPOOL_SIZE
+from DDA import NodeReply, DDA_REPLY_TIMEOUT
+from KeyIndex import hashEntries
 
-def buildOpener(url, proxy=None):
+ANALYZE_TIMEOUT = 10 # seconds for each request to a remote url
+GET_FALLBACK_CODES = (405, 501) # servers which don't allow HEAD
+
+def buildOpener(url, proxy=None, *handlers):
     if len(url)>=4 and url[:4]=='http' and proxy and proxy.get('host','') != '':
         proxies = {'http':'%s:%s' % (proxy['host'],proxy['port']),
                    'https':'%s:%s' % (proxy['host'],proxy['port']),}
         p = urllib2.ProxyHandler(proxies=proxies)
-        opener = urllib2.build_opener(p)
+        opener = urllib2.build_opener(p, *handlers)
     else:
-        opener = urllib2.build_opener()
+        opener = urllib2.build_opener(*handlers)
     return opener
 
-def checkFileForInsert(mimeData, proxy=None):
-    for format in mimeData.formats():
-        if format == "text/uri-list":
-            url = unicode(mimeData.urls()[0].toString()).encode('utf-8') # only use the first one
-            opener = buildOpener(url, proxy)
-            try:
-                u = opener.open(url)
-                for header in u.headers.items():
-                    if header[0] == 'content-type':
-                        u.close()
-                        return (url, header[1])
-            except IOError,e:
-                if e.errno == 21: #directory on linux
-                    return (url,'directory')
-                elif e.errno == 13 and os.path.isdir(url): #directory on windows
-                    return (url,'directory')
-                else:
-                    return False
-            except Exception,e:
-                return False
-    return False
+class HeadRequest(urllib2.Request):
 
-class DirectoryInsert(QThread):
+    def get_method(self):
+        return 'HEAD'
 
-    def __init__(self, parent, url):
-        QThread.__init__(self, parent)
-        self.nodeManager = parent
-        self.url = url
+class UrlAnalysis(object):
+    """ keeps the connections of an analyzeUrl call, so cancel() can shut them down from another
+        thread. A connection which is still being opened is bounded by ANALYZE_TIMEOUT """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = []
+        self.canceled = False
+
+    def handlers(self):
+        analysis = self
+        class HTTPHandler(urllib2.HTTPHandler):
+            def http_open(self, req):
+                return self.do_open(analysis.tracked(httplib.HTTPConnection), req)
+        class HTTPSHandler(urllib2.HTTPSHandler):
+            def https_open(self, req):
+                return self.do_open(analysis.tracked(httplib.HTTPSConnection), req)
+        return [HTTPHandler(), HTTPSHandler()]
+
+    def tracked(self, connectionClass):
+        def connection(host, **kwargs):
+            with self.lock:
+                if self.canceled:
+                    raise urllib2.URLError('canceled')
+                conn = connectionClass(host, **kwargs)
+                self.connections.append(conn)
+            return conn
+        return connection
+
+    def cancel(self):
+        with self.lock:
+            self.canceled = True
+            connections = self.connections
+            self.connections = []
+        for conn in connections:
+            sock = conn.sock
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR) # wakes up the thread reading from it
+                except socket.error, e:
+                    pass
+
+def localPath(url):
+    """ filesystem path of a file url, with its percent escapes decoded """
+    return urllib2.url2pathname(urllib2.Request(url).get_selector())
+
+def dropUrls(mimeData):
+    if not mimeData.hasFormat("text/uri-list"):
+        return []
+    return [unicode(url.toString()).encode('utf-8') for url in mimeData.urls()]
+
+def analyzeUrl(url, proxy=None, analysis=None):
+    """ returns (url, content-type) if url can be inserted, False otherwise. Local files are never
+        opened, remote ones get a HEAD request, or a GET whose body isn't read if the server doesn't
+        answer HEAD with a content type. analysis is an UrlAnalysis to cancel the requests """
+    tmpReq = urllib2.Request(url)
+    if tmpReq.get_type() == 'file':
+        path = localPath(url)
+        if os.path.isdir(path):
+            return (url, 'directory')
+        if not os.path.isfile(path) or not os.access(path, os.R_OK):
+            return False
+        return (url, mimetypes.guess_type(path)[0] or 'application/octet-stream')
+
+    analysis = analysis or UrlAnalysis()
+    opener = buildOpener(url, proxy, *analysis.handlers())
+    contentType = None
+    try:
+        u = opener.open(HeadRequest(url), timeout=ANALYZE_TIMEOUT)
+        contentType = u.headers.get('content-type')
+        u.close()
+    except urllib2.HTTPError, e:
+        if e.code not in GET_FALLBACK_CODES:
+            return False
+    except Exception, e:
+        return False
+    if not contentType and not analysis.canceled:
+        try:
+            u = opener.open(urllib2.Request(url), timeout=ANALYZE_TIMEOUT)
+            contentType = u.headers.get('content-type')
+            u.close() # only the headers are read
+        except Exception, e:
+            return False
+    if analysis.canceled:
+        return False
+    return contentType and (url, contentType) or False
+
+class InsertJob(object):
+    """ base of the insert jobs run by the InsertScheduler. Subclasses implement insert() """
+
+    kind = 'insert' # label of the job's metrics
+
+    def __init__(self, nodeManager):
+        self.nodeManager = nodeManager
+        self.journalId = None
+        self.created = time.time()
+        self.sentBytes = 0 # payload sent directly, disk inserts don't count
+        self.tentative = False # set while a failed put would be followed by another attempt
+        self.error = None
 
     def run(self):
+        journal = self.nodeManager.journal
+        metrics = self.nodeManager.metrics
+        started = time.time()
+        metrics.timing('warren_insert_wait_seconds', started - self.created, kind=self.kind)
+        journal.update(self.journalId, state='sending')
+        try:
+            self.insert()
+            journal.update(self.journalId, state='sent')
+        except Exception, e:
+            self.error = e
+            metrics.count('warren_inserts_failed_total', kind=self.kind)
+            raise
+        else:
+            metrics.count('warren_inserts_total', kind=self.kind)
+            metrics.since('warren_drop_to_node_seconds', self.created, kind=self.kind)
+            if self.sentBytes:
+                elapsed = time.time() - started
+                metrics.count('warren_upload_bytes_total', self.sentBytes)
+                if elapsed > 0:
+                    metrics.gauge('warren_upload_bytes_per_second', self.sentBytes / elapsed)
+        finally:
+            self.nodeManager.insertDone(self)
+
+    def keyKnown(self, key):
+        self.nodeManager.metrics.count('warren_inserts_known_total', kind=self.kind)
+        self.nodeManager.journal.remove(self.journalId)
+        self.nodeManager.insertKeyKnown(key, self)
+
+    def size(self):
+        return 0
+
+    def contentHash(self):
+        """ hash of everything that ends up in the insert, None if it can't be known in advance """
+        return None
+
+    def lookupKey(self, keyType):
+        """ returns the key of an earlier insert of the same content (or None) and the request
+            callback for a new insert, which records its key, hands it out as soon as it's generated
+            and removes the insert from the journal once the node accepted it """
+        recordKey = None
+        digest = self.contentHash()
+        if digest is not None:
+            keyIndex = self.nodeManager.keyIndex
+            key = keyIndex.lookup(digest, keyType)
+            if key:
+                return (key, None)
+            recordKey = keyIndex.recorder(digest, keyType)
+
+        def callback(status, value):
+            if status == 'pending' and isinstance(value, dict) and value.get('header') == 'URIGenerated':
+                self.nodeManager.metrics.since('warren_uri_generated_seconds', self.created, kind=self.kind)
+            if status in ('pending', 'successful'):
+                self.nodeManager.journal.remove(self.journalId)
+            elif isinstance(value, dict) and value.get('header') == 'IdentifierCollision':
+                self.nodeManager.journal.remove(self.journalId) # resumed, but the node got it before
+            if status == 'pending' and isinstance(value, dict) and value.get('header') == 'URIGenerated':
+                self.nodeManager.insertKeyGenerated(value.get('URI'), self)
+            elif status == 'successful' or status == 'failed' and not self.tentative:
+                self.nodeManager.insertCompleted(self, status, value)
+            if recordKey:
+                recordKey(status, value)
+        return (None, callback)
+
+class DirectoryInsert(InsertJob):
+
+    kind = 'directory'
+
+    def __init__(self, nodeManager, url):
+        InsertJob.__init__(self, nodeManager)
+        self.url = url
+        self.archiveStats = None
+
+    def size(self):
+        plainUrl = localPath(self.url)
+        total = 0
+        for (dirPath, dirNames, fileNames) in os.walk(plainUrl):
+            for fileName in fileNames:
+                try:
+                    total += os.path.getsize(os.path.join(dirPath, fileName))
+                except OSError, e:
+                    pass
+        return total
+
+    def contentHash(self):
+        plainUrl = localPath(self.url)
+        parentDir = os.path.dirname(plainUrl.rstrip(os.path.sep))
+        entries = []
+        for (dirPath, dirNames, fileNames) in os.walk(plainUrl):
+            for fileName in fileNames:
+                filePath = os.path.join(dirPath, fileName)
+                entries.append((os.path.relpath(filePath, parentDir), filePath, 'application/zip'))
+        return hashEntries(entries)
+
+    def insert(self):
+        plainUrl = localPath(self.url)
+        if not os.path.isdir(plainUrl):
+            # os.walk would silently yield nothing and an empty archive would be inserted
+            raise IOError(errno.ENOENT, 'No such directory', plainUrl)
+        keyType = self.nodeManager.config['warren']['file_keytype']
+        key, keyCallback = self.lookupKey(keyType)
+        if key:
+            self.keyKnown(key)
+            return
+
         zipFileName, zipFile = self.zipDir(self.url)
+        data = StreamPayload(zipFile, zipFile.tell())
         zipFile.seek(0)
-        keyType = self.nodeManager.config['warren']['file_keytype']
 
-        insert = self.nodeManager.node.put(uri=keyType,data=zipFile.read(),async=True,name=zipFileName,persistence='forever',Global=True,id='Warren-'+zipFileName,mimetype='application/zip',waituntilsent=True,priority=4)
-        self.quit() # because we put everything on node's global queue, we are not interested in what happens after put()
+        self.sentBytes += len(data)
+        priority, realtime = self.nodeManager.insertPriority('Warren-'+zipFileName, len(data))
+        insert = self.nodeManager.dataNode(len(data)).put(uri=keyType,data=data,async=True,name=zipFileName,persistence='forever',Global=True,id='Warren-'+zipFileName,mimetype='application/zip',waituntilsent=True,priority=priority,realtime=realtime,callback=keyCallback)
+        # because we put everything on node's global queue, we are not interested in what happens after put()
 
     def zipDir(self, dirPath):
-        tmpReq = urllib2.Request(self.url)
-        plainUrl = tmpReq.get_selector()
+        plainUrl = localPath(self.url)
         parentDir, dirName = os.path.split(plainUrl)
         includeDirInZip = False
 
@@ -65,79 +250,200 @@ class DirectoryInsert(QThread):
             return os.path.normcase(archivePath)
 
 
-        ramFile = StringIO()
-
-        zipFile = zipfile.ZipFile(ramFile, 'w', compression=zipfile.ZIP_DEFLATED)
-        
+        entries = []
+        emptyDirs = []
         for (archiveDirPath, dirNames, fileNames) in os.walk(plainUrl):
             for fileName in fileNames:
                 filePath = os.path.join(archiveDirPath, fileName)
-                zipFile.write(filePath, os.path.join(dirName,trimPath(filePath)))
+                entries.append((filePath, os.path.join(dirName,trimPath(filePath))))
 
             if not fileNames and not dirNames: # empty folders
-                zipInfo = zipfile.ZipInfo(os.path.join(dirName,trimPath(archiveDirPath) + "/"))
-                zipInfo.external_attr = 0777 << 16L
-                zipFile.writestr(zipInfo, "")
+                emptyDirs.append(os.path.join(dirName,trimPath(archiveDirPath) + "/"))
+
+        # only SPOOL_SIZE bytes of the archive are kept in memory, the rest goes to a temporary file
+        spoolFile = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        from Archiver import Archiver # zipfile and multiprocessing aren't needed at startup
+        self.archiveStats = Archiver().archive(spoolFile, entries, emptyDirs)
+        metrics = self.nodeManager.metrics
+        metrics.timing('warren_archive_seconds', self.archiveStats.seconds)
+        metrics.gauge('warren_archive_bytes_per_second', self.archiveStats.throughput())
 
-        return (dirName+'.zip', ramFile)
+        return (dirName+'.zip', spoolFile)
 
-class FileInsert(QThread):
+class FileInsert(InsertJob):
 
-    def __init__(self, parent, url, mimeType, proxy=None):
-        QThread.__init__(self, parent)
-        self.nodeManager = parent
+    kind = 'file'
+
+    def __init__(self, nodeManager, url, mimeType, proxy=None):
+        InsertJob.__init__(self, nodeManager)
         self.url = url
         self.mimeType = mimeType
         self.proxy = proxy
 
-    def run(self):
-        # Grade-A fugly workaround ahead! pyFreenet can't handle failing testDDARequests, because FCP doesn't work with Identifiers
-        # in this request. So failing DDA jobs die. This is a trial-and-error workaround to see if we can upload the file from 
-        # disk or if we have to send it over socket.
-        # TODO GET RID OF PYFREENET or tell toad_ to fix testDDARequest!!!!!!
-        testDDAResult = False
+    def size(self):
+        tmpReq = urllib2.Request(self.url)
+        if tmpReq.get_type() != 'file':
+            return 0 # unknown, the download is streamed or spooled anyway
+        try:
+            return os.path.getsize(localPath(self.url))
+        except OSError, e:
+            return 0
+
+    def contentHash(self):
+        tmpReq = urllib2.Request(self.url)
+        if tmpReq.get_type() != 'file':
+            return None # remote content may change, we would have to download it first anyway
+        plainUrl = localPath(self.url)
+        return hashEntries([(os.path.basename(plainUrl), plainUrl, self.mimeType)])
+
+    def insert(self):
         keyType = self.nodeManager.config['warren']['file_keytype']
+        key, keyCallback = self.lookupKey(keyType)
+        if key:
+            self.keyKnown(key)
+            return
+
+        filename = os.path.basename(self.url)
         tmpReq = urllib2.Request(self.url)
         if tmpReq.get_type() == 'file':
-            plainUrl = tmpReq.get_selector()
-            try:
-                directory = os.path.split(plainUrl)[0]
-                testDDA = self.nodeManager.node.testDDA(async=False, Directory=directory, WantReadDirectory=True, timeout=5)
-                if 'TestDDAComplete' in str(testDDA.items()): #TODO check for the real keys
-                    testDDAResult = True
-            except Exception, e:
-                testDDAResult = False
-
-            if testDDAResult:
-                opener = buildOpener(self.url, self.proxy)
-                u = opener.open(self.url)
-                filename = os.path.basename(self.url)
-                insert = self.putData(plainUrl, filename, self.mimeType, 'disk', keyType)
-                QThread.msleep(5000)
-                if insert.result is not None and 'ProtocolError' in str(insert.result):
-                    testDDAResult = False
-                    opener.close()
-
-        if not testDDAResult:
-            opener = buildOpener(self.url, self.proxy)
-            u = opener.open(self.url)
-            filename = os.path.basename(self.url)
-            data = u.read() # we have to make this streaming in the future (pyFreenet can't handle it atm)
-            u.close()
-            insert = self.putData(data, filename, self.mimeType, 'data', keyType)
-        self.quit() # because we put everything on node's global queue, we are not interested in what happens after put()
-
-    def putData(self, data, filename, mime_type, method, keyType):
-        #TODO: first check with fcp put method "disk" to check if we're on same machine as node or if node
-        #      has different permissions on selected file.
-        #      only if node answer with error on method "disk", fall back to method "direct"
-        #      AND WHY THE FUCK BLOCKS PYFREENET THE WHOLE PROGRAM WHILE UPLOADING EVEN IF IT RUNS IN THREAD???
+            plainUrl = localPath(self.url)
+            filename = os.path.basename(plainUrl)
+            directory = os.path.split(plainUrl)[0]
+            if self.nodeManager.dda.canRead(self.nodeManager.node, directory):
+                # the node may still refuse the disk upload, so wait for its answer and fall back to sending the data
+                reply = NodeReply(keyCallback)
+                self.tentative = True
+                self.putData(plainUrl, filename, self.mimeType, 'disk', keyType, callback=reply.callback)
+                status = reply.wait(DDA_REPLY_TIMEOUT)
+                self.tentative = False
+                if status != 'failed':
+                    return # because we put everything on node's global queue, we are not interested in what happens after put()
+                self.nodeManager.dda.set(directory, 'read', False)
+
+        opener = buildOpener(self.url, self.proxy)
+        data = openPayload(opener, self.url) # sent in chunks by the node connection, never read as a whole
+        insert = self.putData(data, filename, self.mimeType, 'data', keyType, callback=keyCallback)
+        # because we put everything on node's global queue, we are not interested in what happens after put()
+
+    def putData(self, data, filename, mime_type, method, keyType, callback=None):
         if method == 'data':
-            return self.nodeManager.node.put(uri=keyType,data=data,async=True,name=filename,persistence='forever',Global=True,id='Warren-'+filename,mimetype=mime_type,waituntilsent=True,priority=4)
+            self.sentBytes += len(data)
+            priority, realtime = self.nodeManager.insertPriority('Warren-'+filename, len(data))
+            return self.nodeManager.dataNode(len(data)).put(uri=keyType,data=data,async=True,name=filename,persistence='forever',Global=True,id='Warren-'+filename,mimetype=mime_type,waituntilsent=True,priority=priority,realtime=realtime,callback=callback)
         if method == 'disk':
-            return self.nodeManager.node.put(uri=keyType,file=data,async=True,name=filename,persistence='forever',Global=True,id='Warren-'+filename,mimetype=mime_type,waituntilsent=True,priority=4)
+            priority, realtime = self.nodeManager.insertPriority('Warren-'+filename, os.path.getsize(data))
+            return self.nodeManager.node.put(uri=keyType,file=data,async=True,name=filename,persistence='forever',Global=True,id='Warren-'+filename,mimetype=mime_type,waituntilsent=True,priority=priority,realtime=realtime,callback=callback)
+
+class ManifestInsert(InsertJob):
+    """ puts several dropped items into one manifest (ClientPutComplexDir), so they share a single key """
+
+    kind = 'manifest'
+
+    def __init__(self, nodeManager, items, proxy=None):
+        InsertJob.__init__(self, nodeManager)
+        self.items = items
+        self.proxy = proxy
+        self.files = None
 
+    def size(self):
+        return sum([os.path.getsize(path) for name, url, path, mimeType in self.manifestFiles() if path])
 
+    def manifestFiles(self):
+        """ returns a list of (name in manifest, url, local path or None, content-type) """
+        if self.files is not None:
+            return self.files
+        files = []
+        names = set()
+        def add(name, url, path, mimeType):
+            uniqueName = name
+            count = 1
+            while uniqueName in names:
+                root, ext = os.path.splitext(name)
+                uniqueName = '%s-%d%s' % (root, count, ext)
+                count += 1
+            names.add(uniqueName)
+            files.append((uniqueName, url, path, mimeType))
+
+        for url, mimeType in self.items:
+            tmpReq = urllib2.Request(url)
+            if tmpReq.get_type() != 'file':
+                add(os.path.basename(tmpReq.get_selector().split('?')[0]) or tmpReq.get_host(), url, None, mimeType)
+                continue
+            plainUrl = localPath(url)
+            if mimeType != 'directory':
+                add(os.path.basename(plainUrl), url, plainUrl, mimeType)
+                continue
+            parentDir = os.path.dirname(plainUrl.rstrip(os.path.sep))
+            for (dirPath, dirNames, fileNames) in os.walk(plainUrl):
+                for fileName in fileNames:
+                    filePath = os.path.join(dirPath, fileName)
+                    name = os.path.relpath(filePath, parentDir).replace(os.path.sep, '/')
+                    add(name, None, filePath, mimetypes.guess_type(filePath)[0] or 'application/octet-stream')
+        self.files = files
+        return files
+
+    def contentHash(self):
+        files = self.manifestFiles()
+        if [name for name, url, path, mimeType in files if not path]:
+            return None # remote content may change, we would have to download it first anyway
+        return hashEntries([(name, path, mimeType) for name, url, path, mimeType in files])
+
+    def insert(self):
+        files = self.manifestFiles()
+        if not files:
+            return
+        keyType = self.nodeManager.config['warren']['file_keytype']
+        key, keyCallback = self.lookupKey(keyType)
+        if key:
+            self.keyKnown(key)
+            return
+
+        useDisk = True
+        while True:
+            fields = {}
+            payloads = []
+            for idx, (name, url, path, mimeType) in enumerate(files):
+                prefix = 'Files.%d.' % idx
+                fields[prefix+'Name'] = name
+                fields[prefix+'Metadata.ContentType'] = mimeType
+                if path and useDisk and self.nodeManager.dda.canRead(self.nodeManager.node, os.path.dirname(path)):
+                    fields[prefix+'UploadFrom'] = 'disk'
+                    fields[prefix+'Filename'] = path
+                    continue
+                if path:
+                    payload = FilePayload(path)
+                else:
+                    payload = openPayload(buildOpener(url, self.proxy), url)
+                fields[prefix+'UploadFrom'] = 'direct'
+                fields[prefix+'DataLength'] = len(payload)
+                payloads.append(payload)
+            if payloads:
+                fields['Data'] = MultiPayload(payloads)
 
+            reply = NodeReply(keyCallback)
+            self.tentative = useDisk and len(payloads) < len(files)
+            self.putManifest(fields, files[0][0].split('/')[0], keyType, callback=reply.callback)
+            if not self.tentative:
+                return
+            status = reply.wait(DDA_REPLY_TIMEOUT)
+            self.tentative = False
+            if status != 'failed':
+                return # because we put everything on node's global queue, we are not interested in what happens after put()
 
+            # the node refused to read some of the files itself, send all of them
+            for name, url, path, mimeType in files:
+                if path:
+                    self.nodeManager.dda.set(os.path.dirname(path), 'read', False)
+            useDisk = False
 
+    def putManifest(self, fields, name, keyType, callback=None):
+        if len(self.items) > 1:
+            name = '%s+%d' % (name, len(self.items)-1)
+        data = fields.pop('Data', None)
+        if data is not None:
+            self.sentBytes += len(data)
+        priority, realtime = self.nodeManager.insertPriority('Warren-'+name, self.size())
+        fields.update({'URI':keyType, 'Global':True, 'Persistence':'forever', 'PriorityClass':priority, 'RealTimeFlag':realtime})
+        node = self.nodeManager.dataNode(data is not None and len(data) or 0)
+        return node.submit('Warren-'+name, 'ClientPutComplexDir', fields, data=data,
+                           callback=callback, waituntilsent=True)
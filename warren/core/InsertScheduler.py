@@ -0,0 +1,79 @@
+import threading, heapq, itertools, traceback
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+class InsertScheduler(object):
+    """ runs insert jobs on a fixed number of worker threads. Jobs wait in a
+        priority queue (FIFO within the same priority) and are only started while
+        the bytes in flight stay below maxBytesInFlight. A job needs a run() and
+        a size() method, size() is called from the worker thread """
+
+    def __init__(self, workers=2, maxBytesInFlight=64*1024*1024):
+        self.maxBytesInFlight = maxBytesInFlight
+        self.bytesInFlight = 0
+        self.queue = []
+        self.counter = itertools.count()
+        self.popped = 0
+        self.admitted = 0
+        self.cond = threading.Condition()
+        self.running = True
+        self.workers = []
+        for i in range(max(1, workers)):
+            worker = threading.Thread(target=self._work, name='WarrenInsert-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, job, priority=PRIORITY_NORMAL):
+        with self.cond:
+            heapq.heappush(self.queue, (priority, self.counter.next(), job))
+            self.cond.notify_all()
+
+    def pending(self):
+        with self.cond:
+            return len(self.queue)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            del self.queue[:]
+            self.cond.notify_all()
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                job = heapq.heappop(self.queue)[2]
+                ticket = self.popped
+                self.popped += 1
+
+            try:
+                # a job bigger than the whole budget runs alone
+                cost = min(job.size(), self.maxBytesInFlight)
+            except Exception, e:
+                cost = self.maxBytesInFlight
+
+            # jobs are admitted in the order they left the queue
+            with self.cond:
+                while self.running and (ticket != self.admitted or
+                                        self.bytesInFlight and self.bytesInFlight + cost > self.maxBytesInFlight):
+                    self.cond.wait()
+                if not self.running:
+                    return
+                self.admitted += 1
+                self.bytesInFlight += cost
+                self.cond.notify_all()
+
+            try:
+                job.run()
+            except Exception, e:
+                traceback.print_exc()
+            finally:
+                with self.cond:
+                    self.bytesInFlight -= cost
+                    self.cond.notify_all()
@@ -0,0 +1,63 @@
+import json, threading, time
+import os, os.path
+
+MAX_ATTEMPTS = 3 # an insert which failed this often isn't resumed any more
+
+class InsertJournal(object):
+    """ on-disk list of the inserts which haven't been accepted by the node yet.
+        Each entry has the dropped items, the number of attempts and a state:
+        'queued' (waiting for a worker), 'sending' (payload is being sent) or
+        'sent' (payload sent, but the node didn't answer yet). Entries are removed
+        as soon as the node answers, so after a crash or reconnect everything
+        left in the journal has to be submitted again """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.entries = {}
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as f:
+                    self.entries = json.load(f)
+            except ValueError, e:
+                self.entries = {} # broken journal, nothing we can do about it
+
+    def add(self, items):
+        with self.lock:
+            journalId = None
+            while journalId is None or journalId in self.entries:
+                self.counter += 1
+                journalId = '%x-%06d' % (int(time.time()), self.counter)
+            self.entries[journalId] = {'items':items, 'state':'queued', 'attempts':0}
+            self._write()
+        return journalId
+
+    def update(self, journalId, **fields):
+        with self.lock:
+            if journalId not in self.entries:
+                return
+            self.entries[journalId].update(fields)
+            self._write()
+
+    def remove(self, journalId):
+        with self.lock:
+            if self.entries.pop(journalId, None) is not None:
+                self._write()
+
+    def unfinished(self, exclude=()):
+        """ returns a list of (journalId, entry) to submit again, entries that failed too often are dropped """
+        with self.lock:
+            for journalId, entry in self.entries.items():
+                if entry['attempts'] >= MAX_ATTEMPTS:
+                    del self.entries[journalId]
+            self._write()
+            return [(journalId, dict(entry)) for journalId, entry in sorted(self.entries.items()) if journalId not in exclude]
+
+    def _write(self):
+        tmpName = self.filename + '.tmp'
+        with open(tmpName, 'w') as f:
+            json.dump(self.entries, f)
+        if os.name == 'nt' and os.path.exists(self.filename):
+            os.remove(self.filename) # no atomic replace on windows
+        os.rename(tmpName, self.filename)
@@ -0,0 +1,67 @@
+import hashlib, threading
+import os.path
+from Streaming import CHUNK_SIZE
+
+def hashFile(path):
+    """ sha256 of a file, read in chunks. hashlib releases the GIL, so several run in parallel """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hashEntries(entries, workers=None):
+    """ hash of a list of (name, path, content-type), e.g. the files of a
+        directory or manifest. The files are hashed in parallel """
+    from multiprocessing.pool import ThreadPool # multiprocessing isn't needed at startup
+    from multiprocessing import cpu_count
+    entries = sorted(entries)
+    pool = ThreadPool(min(workers or cpu_count(), max(1, len(entries))))
+    try:
+        fileHashes = pool.map(hashFile, [path for name, path, mimeType in entries])
+    finally:
+        pool.close()
+    digest = hashlib.sha256()
+    for (name, path, mimeType), fileHash in zip(entries, fileHashes):
+        digest.update('%s\0%s\0%s\n' % (name, mimeType, fileHash))
+    return digest.hexdigest()
+
+class KeyIndex(object):
+    """ persistent map of (content hash, key type) to the key of a finished insert.
+        Stored as an append-only text file, one tab separated 'hash keytype key' line per insert """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.keys = {}
+        self.lock = threading.Lock()
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t', 2)
+                    if len(fields) == 3:
+                        self.keys[(fields[0], fields[1])] = fields[2]
+
+    def lookup(self, digest, keyType):
+        with self.lock:
+            return self.keys.get((digest, keyType))
+
+    def add(self, digest, keyType, key):
+        with self.lock:
+            if self.keys.get((digest, keyType)) == key:
+                return
+            self.keys[(digest, keyType)] = key
+            with open(self.filename, 'a') as f:
+                f.write('%s\t%s\t%s\n' % (digest, keyType, key))
+
+    def recorder(self, digest, keyType):
+        """ request callback which adds the key once the insert succeeded """
+        def callback(status, value):
+            if status != 'successful':
+                return
+            uri = isinstance(value, dict) and value.get('URI') or value
+            if uri:
+                self.add(digest, keyType, str(uri))
+        return callback
@@ -0,0 +1,102 @@
+import threading, hashlib, re, time
+
+SAMPLE_SIZE = 4*1024 # characters from the start and from the end of a paste
+GUESS_BUDGET = 0.5 # seconds, the lexers not asked by then are skipped
+CACHE_SIZE = 64
+MIN_RATING = 0.1 # lower ratings are given to nearly any text
+
+SHEBANG = re.compile(r'^#!\s*(\S+)(?:\s+(\S+))?')
+MODELINE = re.compile(r'(?:-\*-.*?mode:\s*([\w+#-]+).*?-\*-)|(?:\b(?:vim?|ex):.*?\b(?:ft|filetype|syntax)=([\w+#-]+))')
+
+class LanguageGuess(object):
+    """ guesses the lexer of a paste from a sample of its start and end, so it takes about
+        the same time for any paste size. A shebang or an emacs or vim modeline wins,
+        otherwise pygments' lexers rate the sample until the time budget is used up. A guess
+        which ran out of time isn't cached """
+
+    def __init__(self, sampleSize=SAMPLE_SIZE, budget=GUESS_BUDGET, cacheSize=CACHE_SIZE):
+        self.sampleSize = sampleSize
+        self.budget = budget
+        self.cacheSize = cacheSize
+        self.cache = {} # hash of the sample -> lexer alias
+        self.classes = None
+        self.lock = threading.Lock()
+
+    def guess(self, text):
+        """ returns the alias of a lexer, 'text' if nothing fits """
+        if len(text) <= 2*self.sampleSize:
+            return self.guessSample(text, len(text))
+        return self.guessEnds(text[:self.sampleSize], text[-self.sampleSize:], len(text))
+
+    def guessEnds(self, start, end, length):
+        """ guess from the first and the last sampleSize characters of a text of length characters,
+            for texts which aren't at hand as one string """
+        # whole lines only, a lexer shouldn't see half a token
+        return self.guessSample(start[:start.rfind('\n')+1 or None] + end[end.find('\n')+1:], length)
+
+    def guessSample(self, sample, length):
+        digest = hashlib.sha1(('%d\0' % length) + sample.encode('utf-8')).hexdigest()
+        with self.lock:
+            alias = self.cache.get(digest)
+        if alias is not None:
+            return alias
+        alias, complete = self.hinted(sample), True
+        if alias is None:
+            alias, complete = self.rated(sample)
+        alias = alias or 'text'
+        if not complete:
+            return alias
+        with self.lock:
+            if len(self.cache) >= self.cacheSize:
+                self.cache.clear()
+            self.cache[digest] = alias
+        return alias
+
+    def hinted(self, sample):
+        """ alias named by a shebang or modeline """
+        from pygments.lexers import get_lexer_by_name
+        from pygments.util import ClassNotFound
+        names = []
+        lines = sample.splitlines()
+        match = lines and SHEBANG.match(lines[0])
+        if match:
+            interpreter = match.group(1).split('/')[-1]
+            if interpreter == 'env' and match.group(2):
+                interpreter = match.group(2)
+            names.append(interpreter)
+            names.append(interpreter.rstrip('0123456789.')) # python2.7 -> python
+        for line in lines[:5] + lines[-5:]:
+            match = MODELINE.search(line)
+            if match:
+                names.append((match.group(1) or match.group(2)).lower())
+        for name in names:
+            try:
+                return get_lexer_by_name(name).aliases[0]
+            except ClassNotFound, e:
+                continue
+        return None
+
+    def lexerClasses(self):
+        """ pygments' lexer classes, loaded once. It takes longer than the budget, so it isn't part of it """
+        with self.lock:
+            if self.classes is None:
+                from pygments.lexers import get_all_lexers, find_lexer_class
+                classes = [find_lexer_class(name) for name, aliases, filenames, mimeTypes in get_all_lexers() if aliases]
+                self.classes = [lexer for lexer in classes if lexer is not None]
+            return self.classes
+
+    def rated(self, sample):
+        """ (alias, complete): the alias of the lexer which rates the sample best, None if no rating
+            is convincing. complete is False if the budget ran out before all lexers were asked """
+        lexers = self.lexerClasses()
+        deadline = time.time() + self.budget
+        best, bestRating = None, MIN_RATING
+        for lexer in lexers:
+            rating = lexer.analyse_text(sample)
+            if rating > bestRating:
+                best, bestRating = lexer.aliases[0], rating
+                if rating >= 1.0:
+                    return best, True
+            if time.time() > deadline:
+                return best, False
+        return best, True
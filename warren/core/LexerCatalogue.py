@@ -0,0 +1,61 @@
+import json, threading
+import os, os.path
+
+MAX_RECENT = 5
+
+class LexerCatalogue(object):
+    """ names and aliases of pygments' lexers. get_all_lexers walks all plugins, so the list is
+        stored with the pygments version it was built for, together with the recently used lexers """
+
+    def __init__(self, filename, maxRecent=MAX_RECENT):
+        self.filename = filename
+        self.maxRecent = maxRecent
+        self.lock = threading.Lock()
+        self.data = {'version':None, 'lexers':[], 'recent':[]}
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as f:
+                    self.data.update(json.load(f))
+            except ValueError, e:
+                pass
+
+    def lexers(self):
+        """ sorted list of (name, alias) """
+        import pygments
+        with self.lock:
+            if self.data['version'] != pygments.__version__ or not self.data['lexers']:
+                from pygments.lexers import get_all_lexers
+                self.data['lexers'] = sorted([name, aliases[0]] for name, aliases, filenames, mimeTypes in get_all_lexers() if aliases)
+                self.data['version'] = pygments.__version__
+                self._write()
+            return [(name, alias) for name, alias in self.data['lexers']]
+
+    def recent(self):
+        """ (name, alias) of the recently used lexers, the last used first """
+        names = dict((alias, name) for name, alias in self.lexers())
+        with self.lock:
+            return [(names[alias], alias) for alias in self.data['recent'] if alias in names]
+
+    def lastUsed(self):
+        """ alias of the last used lexer, it may not be in the list, e.g. 'auto' """
+        with self.lock:
+            return self.data['recent'] and self.data['recent'][0] or None
+
+    def used(self, alias):
+        with self.lock:
+            recent = [alias] + [other for other in self.data['recent'] if other != alias]
+            if recent == self.data['recent']:
+                return
+            self.data['recent'] = recent[:self.maxRecent]
+            self._write()
+
+    def _write(self):
+        tmpName = self.filename + '.tmp'
+        try:
+            with open(tmpName, 'w') as f:
+                json.dump(self.data, f)
+            if os.name == 'nt' and os.path.exists(self.filename):
+                os.remove(self.filename)
+            os.rename(tmpName, self.filename)
+        except (IOError, OSError), e:
+            pass # built again next time
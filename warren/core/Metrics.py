@@ -0,0 +1,141 @@
+import threading, time, json
+import logging, logging.handlers
+
+METRICS_FILE_SIZE = 1024*1024
+METRICS_FILE_BACKUPS = 3
+
+class Metrics(object):
+    """ counters, gauges and timings of warren. Names follow prometheus conventions,
+        labels are passed as keyword arguments """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timings = {} # (name, labels) -> [count, sum, max]
+        self.started = time.time()
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def timing(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                self.timings[key] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+
+    def since(self, name, start, **labels):
+        """ records the seconds passed since start """
+        self.timing(name, time.time() - start, **labels)
+
+    def snapshot(self):
+        """ all values as a dict, e.g. for a json dump """
+        with self.lock:
+            values = {}
+            for (name, labels), value in self.counters.items() + self.gauges.items():
+                values[metricName(name, labels)] = value
+            for (name, labels), (count, total, maximum) in self.timings.items():
+                values[metricName(name, labels)] = {'count':count, 'sum':total, 'max':maximum}
+        return values
+
+    def prometheus(self):
+        """ all values in prometheus' text format """
+        lines = []
+        with self.lock:
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted(set(name for name, labels in values)):
+                    lines.append('# TYPE %s %s' % (name, kind))
+                    for (valueName, labels), value in sorted(values.items()):
+                        if valueName == name:
+                            lines.append('%s %s' % (metricName(name, labels), formatValue(value)))
+            for name in sorted(set(name for name, labels in self.timings)):
+                lines.append('# TYPE %s summary' % name)
+                for (valueName, labels), (count, total, maximum) in sorted(self.timings.items()):
+                    if valueName == name:
+                        lines.append('%s %d' % (metricName(name + '_count', labels), count))
+                        lines.append('%s %s' % (metricName(name + '_sum', labels), formatValue(total)))
+        return '\n'.join(lines) + '\n'
+
+def metricName(name, labels):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                      for key, value in labels))
+
+def formatValue(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class MetricsLog(threading.Thread):
+    """ appends a json snapshot of the metrics to a file every interval seconds and
+        once more when it is stopped, the file is rotated when it gets too big """
+
+    def __init__(self, metrics, filename, interval=60):
+        threading.Thread.__init__(self, name='WarrenMetricsLog')
+        self.daemon = True
+        self.metrics = metrics
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.handler = logging.handlers.RotatingFileHandler(filename, maxBytes=METRICS_FILE_SIZE, backupCount=METRICS_FILE_BACKUPS)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        # not from logging.getLogger, each instance has its own handler and the logger goes away with it
+        self.log = logging.Logger('warren.metrics', logging.INFO)
+        self.log.addHandler(self.handler)
+        self.start()
+
+    def run(self):
+        while not self.stopped.isSet():
+            self.stopped.wait(self.interval)
+            self.write()
+
+    def write(self):
+        self.log.info(json.dumps({'time':time.time(), 'metrics':self.metrics.snapshot()}, sort_keys=True))
+
+    def stop(self):
+        self.stopped.set()
+        if self is not threading.current_thread():
+            self.join()
+        self.log.removeHandler(self.handler)
+        self.handler.close()
+
+class MetricsServer(threading.Thread):
+    """ serves the metrics in prometheus' text format on http://127.0.0.1:port/metrics """
+
+    def __init__(self, metrics, port):
+        threading.Thread.__init__(self, name='WarrenMetricsServer')
+        self.daemon = True
+        import BaseHTTPServer # only needed with metrics_port set
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = metrics.prometheus()
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+            def log_message(handler, format, *args):
+                pass
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', port), Handler)
+        self.start()
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
@@ -1,84 +1,49 @@
-from fcp import FCPNode
 from PyQt4.QtCore import QThread, SIGNAL, QString, pyqtSignal
 from PyQt4.QtGui import QDialog, QClipboard, qApp
 from warren.ui.FileSent import Ui_fileDroppedDialog
 from warren.ui.PasteInsert import Ui_PasteInsertDialog
-import FileManager
-import os.path
+from warren.ui.InsertFinishedDialog import Ui_InsertFinishedDialog
+from Engine import Engine
+from PasteRenderer import PasteRenderer, chunkRanges
+from LanguageGuess import LanguageGuess
+from Streaming import SpoolPayload, SPOOL_SIZE
+import time, hashlib, tempfile, threading
 
-from pygments import highlight
-from pygments import lexers
-from pygments.formatters import HtmlFormatter
+CHK_ONLY_TIMEOUT = 30
 
+class NodeManager(QThread, Engine):
+    """ the Engine for the GUI, its hooks are turned into Qt signals and dialogs """
 
-SECLEVELS = {'LOW':0, 'NORMAL':1, 'HIGH':2, 'MAXIMUM':3}
-
-class NodeManager(QThread):
+    role = 'ui'
 
     pasteCanceledMessage = pyqtSignal()
+    knownKey = pyqtSignal(object)
+    generatedKey = pyqtSignal(object)
+    queueProgress = pyqtSignal(object)
 
     def __init__(self,config):
         QThread.__init__(self, None)
-        self.config = config
-        self.node = None
+        Engine.__init__(self, config)
         self.standby = True
-        self.physicalSeclevel = None
-        self.nodeDownloadDir = None
-        self.downloadDDA = False
-        self.start()
+        self.pasteRenderer = PasteRenderer()
+        self.languageGuess = LanguageGuess()
+        self.stylesheetLock = threading.Lock()
+        self.stylesheetInsert = False # the compact pastes' stylesheet is being inserted
+        self.knownKey.connect(self.showKnownKey)
+        self.generatedKey.connect(self.showGeneratedKey)
 
     def run(self):
-        QThread.msleep(1000) # wait a second or sometimes signals can't get through right after startup
-        self.connectNode()
-        self.watchdog = NodeWatchdog(self)
-        self.connect(self.watchdog, SIGNAL("nodeNotConnected()"), self.nodeNotConnected)
+        """ started by the main window once its slots are connected, so no signal gets lost """
+        self.startWatchdog()
 
-    def connectNode(self):
-        try:
-            self.node = FCPNode(name="WarrenClient",host=self.config['node']['host'],port=int(self.config['node']['fcp_port']),verbosity=0)
-            self.updateNodeConfigValues()
+    def nodeStateChanged(self, connected):
+        if connected:
             self.emit(SIGNAL("nodeConnected()"))
-        except Exception, e:
-            self.node = None
-
-    def updateNodeConfigValues(self):
-        nconfig = self.node.getconfig(async=False,WithCurrent=True,WithExpertFlag=True)
-        self.physicalSeclevel = SECLEVELS[nconfig['current.security-levels.physicalThreatLevel']]
-        self.nodeDownloadDir = nconfig['current.node.downloadsDir']
-        self.downloadDDA = nconfig['expertFlag.fcp.assumeDownloadDDAIsAllowed']=='true'
-        if not os.path.isabs(self.nodeDownloadDir):
-            self.nodeDownloadDir = os.path.join(nconfig['current.node.cfgDir'], self.nodeDownloadDir)
-
-    def nodeNotConnected(self):
-        self.emit(SIGNAL("nodeConnectionLost()"))
-        if self.node:
-            self.node.shutdown()
-            self.node = None
-        self.connectNode()
-
-    def putKeyOnQueue(self, key):
-        if self.physicalSeclevel > 0:
-            testDDAResult = False
-        else:
-            if self.downloadDDA:
-                testDDAResult = True
-            else:
-                testDDAResult = False
-                try:
-                    testDDA = self.node.testDDA(async=False, Directory=self.nodeDownloadDir, WantWriteDirectory=True, timeout=5)
-
-                    if 'TestDDAComplete' in str(testDDA.items()) and "'WriteDirectoryAllowed', 'true'" in str(testDDA.items()): #TODO check for the real keys
-                        testDDAResult = True
-                except Exception, e:
-                    testDDAResult = False
-
-        if testDDAResult:
-            filename = os.path.join(self.nodeDownloadDir, key.split('/')[-1])
-            self.node.get(key,async=True, Global=True, persistence='forever',priority=4, id='Warren:'+key.split('/')[-1], file=filename)
         else:
-            self.node.get(key,async=True, Global=True, persistence='forever',priority=4, id='Warren:'+key.split('/')[-1])
-
+            self.emit(SIGNAL("nodeConnectionLost()"))
 
+    def queueProgressChanged(self, summary):
+        self.queueProgress.emit(summary)
 
     def pasteCanceled(self):
         if hasattr(self, 'pasteInsert'):
@@ -103,21 +68,36 @@ class NodeManager(QThread):
     def pasteMessageForwarder(self, msg):
         self.emit(SIGNAL("inserterMessage(QString)"),QString(msg))
 
-    def insertFile(self, url, mimeType):
-        if mimeType == 'directory':
-            fileInsert = FileManager.DirectoryInsert(self, url)
-        else:
-            fileInsert = FileManager.FileInsert(self, url, mimeType, proxy=self.config['proxy']['http'])
-        fileInsert.start()
+    def insertFiles(self, items):
+        fileInsert = Engine.insertFiles(self, items)
+        self.showDroppedTip()
+        return fileInsert
+
+    def showDroppedTip(self):
         showTip = self.config['warren'].as_bool('show_file_dropped_dialog')
         if showTip:
             self.dropped = FileDropped(self)
             self.dropped.show()
 
+    def insertKeyKnown(self, key, fileInsert):
+        self.knownKey.emit(key)
+
+    def showKnownKey(self, key):
+        self.insertFinished = InsertFinished(key, 'This was inserted before. Copy the request key from below:')
+        self.insertFinished.show()
+
+    def insertKeyGenerated(self, key, fileInsert):
+        if self.config['warren'].as_bool('key_first'):
+            self.generatedKey.emit(key)
+
+    def showGeneratedKey(self, key):
+        self.insertFinished = InsertFinished(key, 'The insert continues in the background. Copy the request key from below:')
+        self.insertFinished.setWindowTitle('Key generated')
+        self.insertFinished.show()
+
     def stop(self):
-        self.watchdog.quit()
-        if self.node:
-            self.node.shutdown()
+        Engine.stop(self)
+        self.pasteRenderer.close()
         self.quit()
 
 class PasteInsert(QDialog):
@@ -152,9 +132,15 @@ class PasteInsert(QDialog):
                 self.ui.keyLineEdit.setCursorPosition(0)
                 self.ui.pushButton.setEnabled(True)
                 self.key = val2.get('URI')
+                if val2.get('Precomputed'):
+                    self.pasteClipCopy()
+            elif val2.get('header') == 'RenderProgress':
+                self.ui.progressBar.setMaximum(1000)
+                self.ui.progressBar.setValue(1000 * val2.get('Done') / max(1, val2.get('Total')))
             elif val2.get('header') == 'SimpleProgress':
-                self.ui.progressBar.setMaximum(val2.get('Total'))
-                self.ui.progressBar.setValue(val2.get('Succeeded'))
+                # FCP fields are strings
+                self.ui.progressBar.setMaximum(int(val2.get('Total', 0)))
+                self.ui.progressBar.setValue(int(val2.get('Succeeded', 0)))
         elif val1=='failed':
             self.ui.keyLineEdit.setText('Insert Failed: '+ str(val2.get('CodeDescription','Unknown error')))
         elif val1=='successful':
@@ -184,9 +170,26 @@ class FileDropped(QDialog):
         self.hide()
         self.close()
 
+class InsertFinished(QDialog):
+
+    def __init__(self, key, message):
+        QDialog.__init__(self, None)
+        self.ui = Ui_InsertFinishedDialog()
+        self.ui.setupUi(self)
+        self.ui.label.setText(message)
+        self.ui.keyLineEdit.setReadOnly(True)
+        self.ui.keyLineEdit.setText(key)
+        self.ui.keyLineEdit.setCursorPosition(0)
+        self.key = key
+
+        clip = qApp.clipboard()
+        clip.setText(str(self.key))
+        if clip.supportsSelection():
+            clip.setText(str(self.key),QClipboard.Selection)
+
 class PutPaste(QThread):
     """ use own thread because we can't send QT signals
-        asynchronously from the pyFreenet thread anyway"""
+        asynchronously from the FCP reader thread anyway"""
 
     message = pyqtSignal(object)
 
@@ -197,44 +200,113 @@ class PutPaste(QThread):
         self.node = parent.node
         self.lexer = lexer
         self.lineNos = lineNos == 'True' and 'Table' or False
+        self.created = time.time()
+        self.keyShown = False
+        # only SPOOL_SIZE bytes of the page are kept in memory, the rest goes to a temporary file
+        self.spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
 
     def run(self):
         keyType = self.nodeManager.config['warren']['pastebin_keytype']
-        insert = self.putPaste(self.paste, self.insertcb, async=True, keyType=keyType)
-        insert.wait()
+        try:
+            insert = self.putPaste(self.paste, self.insertcb, async=True, keyType=keyType)
+            self.nodeManager.metrics.since('warren_paste_sent_seconds', self.created)
+            insert.wait()
+        finally:
+            self.spool.close()
+
+    def chunks(self, qPaste, callback):
+        """ the paste as unicode strings of about CHUNK_SIZE characters which end at a line end,
+            longer lines are split after MAX_CHUNK_SIZE. The progress is reported to the callback """
+        def findNewline(start, end):
+            newline = qPaste.mid(start, end - start).indexOf('\n')
+            return newline >= 0 and start + newline or -1
+        length = qPaste.length()
+        for start, end in chunkRanges(length, findNewline, lambda pos: qPaste.at(pos).isHighSurrogate()):
+            yield unicode(qPaste.mid(start, end - start))
+            callback('pending', {'header':'RenderProgress', 'Done':end, 'Total':length})
 
     def putPaste(self, qPaste, callback, async=True, keyType='SSK@'):
-        paste = unicode(qPaste)
+        """ the paste is highlighted chunk by chunk into the spool, neither the whole text nor the
+            whole page is in memory at once """
+        if self.lexer == 'auto':
+            started = time.time()
+            guess = self.nodeManager.languageGuess
+            if qPaste.length() <= 2*guess.sampleSize:
+                self.lexer = guess.guess(unicode(qPaste))
+            else:
+                self.lexer = guess.guessEnds(unicode(qPaste.left(guess.sampleSize)), unicode(qPaste.right(guess.sampleSize)), qPaste.length())
+            self.nodeManager.metrics.since('warren_paste_guess_seconds', started)
         if self.lexer == 'text' and not self.lineNos:
-            paste = paste.encode('utf-8')
+            for chunk in self.chunks(qPaste, callback):
+                self.spool.write(chunk.encode('utf-8'))
             mimeType = "text/plain; charset=utf-8"
         else:
-            paste = highlight(paste, lexers.get_lexer_by_name(self.lexer), HtmlFormatter(encoding='utf-8',full=True,linenos=self.lineNos))
+            started = time.time()
+            compact = self.nodeManager.config['warren'].as_bool('paste_compact')
+            stylesheet = compact and self.stylesheetKey() or None
+            lines = qPaste.count('\n') + (not qPaste.endsWith('\n') and 1 or 0)
+            self.nodeManager.pasteRenderer.renderTo(self.spool, self.chunks(qPaste, callback), self.lexer, lines,
+                                                    self.lineNos, compact=compact, stylesheet=stylesheet)
             mimeType = "text/html; charset=utf-8"
+            self.nodeManager.metrics.since('warren_paste_render_seconds', started)
+        paste = SpoolPayload(self.spool, self.spool.tell())
+        self.nodeManager.metrics.count('warren_paste_bytes_total', len(paste))
+
+        if keyType == 'CHK@' and self.nodeManager.config['warren'].as_bool('key_first'):
+            self.precomputeKey(paste, mimeType, callback)
 
-        insert = self.node.put(uri=keyType,data=paste,async=async,name='pastebin',Verbosity=5,mimetype=mimeType,callback=callback,waituntilsent=True,priority=2,realtime=True)
+        priority, realtime = self.nodeManager.priorities.forPaste()
+        insert = self.node.put(uri=keyType,data=paste,async=async,name='pastebin',Verbosity=5,mimetype=mimeType,callback=callback,waituntilsent=True,priority=priority,realtime=realtime)
         return insert
 
+    def precomputeKey(self, paste, mimeType, callback):
+        """ a CHK only depends on the content, so the node can tell us the key before anything is inserted """
+        try:
+            job = self.node.put(uri='CHK@',data=paste,async=True,chkonly=True,name='pastebin',mimetype=mimeType,realtime=True)
+            uri = job.wait(CHK_ONLY_TIMEOUT)
+        except Exception, e:
+            return # the insert will generate the key anyway
+        if isinstance(uri, dict):
+            uri = uri.get('URI')
+        if uri:
+            callback('pending', {'header':'URIGenerated', 'URI':uri, 'Precomputed':True})
+
+    def stylesheetKey(self):
+        """ key of the stylesheet shared by all compact pastes, once its insert succeeded. Until then
+            it's inserted in the background, once per session, and None is returned, the page
+            embeds the stylesheet. A failed insert is tried again with the next paste """
+        css = self.nodeManager.pasteRenderer.css(compact=True).encode('utf-8')
+        digest = hashlib.sha256(css).hexdigest()
+        nodeManager, keyIndex = self.nodeManager, self.nodeManager.keyIndex
+        key = keyIndex.lookup(digest, 'CHK@')
+        if key:
+            return key
+        with nodeManager.stylesheetLock:
+            if nodeManager.stylesheetInsert:
+                return None
+            nodeManager.stylesheetInsert = True
+        record = keyIndex.recorder(digest, 'CHK@')
+        def inserted(status, value):
+            record(status, value)
+            if status == 'failed':
+                with nodeManager.stylesheetLock:
+                    nodeManager.stylesheetInsert = False
+        try:
+            priority, realtime = nodeManager.priorities.forPaste()
+            self.node.put(uri='CHK@',data=css,async=True,name='pastebin.css',mimetype='text/css',
+                          priority=priority,realtime=realtime,callback=inserted)
+        except Exception, e:
+            inserted('failed', None)
+        return None
+
     def insertcb(self,val1,val2):
+        metrics = self.nodeManager.metrics
+        if val1 == 'pending' and val2.get('header') == 'URIGenerated' and not self.keyShown:
+            self.keyShown = True
+            metrics.since('warren_paste_uri_generated_seconds', self.created)
+        elif val1 == 'successful':
+            metrics.count('warren_pastes_total')
+            metrics.since('warren_paste_inserted_seconds', self.created)
+        elif val1 == 'failed':
+            metrics.count('warren_pastes_failed_total')
         self.message.emit([val1,val2])
-
-class NodeWatchdog(QThread):
-
-    def __init__(self,nodeManager):
-        QThread.__init__(self, None)
-        self.nodeManager = nodeManager
-        self.start()
-
-    def run(self):
-        QThread.msleep(10000) # on startup wait additional 10 seconds
-        while(True):
-            QThread.msleep(5000)
-            isNodeRunning = self.nodeManager.node is not None and self.nodeManager.node.running
-            isNodeAlive = self.nodeManager.node is not None and self.nodeManager.node.nodeIsAlive
-            try:
-                self.nodeManager.node._submitCmd('warren_ping','Void',async=False,timeout=1)
-            except:
-                pass
-            if not isNodeRunning or not isNodeAlive:
-                self.emit(SIGNAL("nodeNotConnected()"))
-
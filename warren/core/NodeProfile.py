@@ -0,0 +1,83 @@
+import json, threading, time
+import os, os.path
+
+SECLEVELS = {'LOW':0, 'NORMAL':1, 'HIGH':2, 'MAXIMUM':3}
+
+class NodeProfile(object):
+    """ the few facts about the node's configuration warren needs """
+
+    FIELDS = ('build', 'physicalSeclevel', 'downloadsDir', 'assumeDownloadDDA', 'updated')
+
+    def __init__(self, build=None, physicalSeclevel=None, downloadsDir=None, assumeDownloadDDA=False, updated=None):
+        self.build = build
+        self.physicalSeclevel = physicalSeclevel
+        self.downloadsDir = downloadsDir
+        self.assumeDownloadDDA = assumeDownloadDDA
+        self.updated = updated or time.time()
+
+    @classmethod
+    def fromConfig(cls, nconfig, nodeHello):
+        """ profile from a ConfigData message (WithCurrent) and the NodeHello of the connection """
+        downloadsDir = nconfig['current.node.downloadsDir']
+        if not os.path.isabs(downloadsDir):
+            downloadsDir = os.path.join(nconfig['current.node.cfgDir'], downloadsDir)
+        return cls(build=nodeBuild(nodeHello),
+                   physicalSeclevel=SECLEVELS[nconfig['current.security-levels.physicalThreatLevel']],
+                   downloadsDir=downloadsDir,
+                   assumeDownloadDDA=nconfig.get('current.fcp.assumeDownloadDDAIsAllowed') == 'true')
+
+    @classmethod
+    def fromDict(cls, values):
+        return cls(**dict((str(key), value) for key, value in values.items() if key in cls.FIELDS))
+
+    def toDict(self):
+        return dict((key, getattr(self, key)) for key in self.FIELDS)
+
+    def sameConfig(self, other):
+        return other is not None and all(getattr(self, key) == getattr(other, key) for key in self.FIELDS if key != 'updated')
+
+    def downloadToDisk(self):
+        """ None if the node's download dir has to be tested with TestDDA first """
+        if self.physicalSeclevel > 0:
+            return False
+        if self.assumeDownloadDDA:
+            return True
+        return None
+
+def nodeBuild(nodeHello):
+    return '%s/%s' % (nodeHello.get('Build'), nodeHello.get('Revision'))
+
+class NodeProfileCache(object):
+    """ NodeProfiles stored per host:port, so a reconnect doesn't wait for the node's config """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.profiles = {}
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as f:
+                    self.profiles = json.load(f)
+            except ValueError, e:
+                self.profiles = {}
+
+    def get(self, host, port, nodeHello):
+        """ the stored profile, None if there is none or the node was updated in between """
+        with self.lock:
+            values = self.profiles.get('%s:%s' % (host, port))
+        if values is None:
+            return None
+        profile = NodeProfile.fromDict(values)
+        if profile.build != nodeBuild(nodeHello):
+            return None
+        return profile
+
+    def store(self, host, port, profile):
+        with self.lock:
+            self.profiles['%s:%s' % (host, port)] = profile.toDict()
+            tmpName = self.filename + '.tmp'
+            with open(tmpName, 'w') as f:
+                json.dump(self.profiles, f)
+            if os.name == 'nt' and os.path.exists(self.filename):
+                os.remove(self.filename)
+            os.rename(tmpName, self.filename)
@@ -0,0 +1,200 @@
+import threading, re
+from StringIO import StringIO
+
+CHUNK_SIZE = 256*1024 # characters highlighted at once, chunks end at a line end
+MAX_CHUNK_SIZE = 2*CHUNK_SIZE # characters, a longer line is split
+WORKER_MIN_SIZE = 64*1024 # characters, smaller chunks are highlighted in the calling thread
+WORKER_TIMEOUT = 300 # seconds
+LINENOS_BATCH = 10000 # line numbers written at once
+
+PAGE = u"""<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">
+<html>
+<head>
+<title>%(title)s</title>
+<meta http-equiv="content-type" content="text/html; charset=utf-8">
+<style type="text/css">
+%(css)s
+</style>
+</head>
+<body>
+%(body)s
+</body>
+</html>
+"""
+PAGE_HEAD, PAGE_TAIL = PAGE.split('%(body)s')
+
+# no whitespace between tags and the stylesheet is linked, the content type header has the charset
+COMPACT_PAGE = u'<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">' \
+               u'<html><head><title>%(title)s</title>%(style)s</head><body>%(body)s</body></html>'
+COMPACT_HEAD, COMPACT_TAIL = COMPACT_PAGE.split('%(body)s')
+
+SPAN = re.compile(r'<span class="([\w-]+)">([^<]*)</span>')
+
+def minifyCss(css):
+    css = re.sub(r'/\*.*?\*/', '', css)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r' ?([{};:,>]) ?', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+def compactSpans(body, styled):
+    """ drops the spans of tokens without a style, e.g. names and punctuation, and the quotes
+        of the class attributes. Tokens never contain a '<', it's escaped """
+    def replace(match):
+        cssClass, text = match.groups()
+        if cssClass not in styled:
+            return text
+        return '<span class=%s>%s</span>' % (cssClass, text)
+    return SPAN.sub(replace, body.replace('<span></span>', ''))
+
+def chunkRanges(length, findNewline, isHighSurrogate):
+    """ (start, end) of the chunks of a text of length characters: about CHUNK_SIZE characters which
+        end at a line end, longer lines are split after MAX_CHUNK_SIZE. findNewline(start, end) is the
+        position of the first line end between them or -1, isHighSurrogate(pos) tells if a surrogate
+        pair starts there. Only the part up to the limit is searched, so a paste of one long line
+        isn't scanned again for each chunk """
+    pos = 0
+    while pos < length:
+        newline = findNewline(pos + CHUNK_SIZE, min(length, pos + MAX_CHUNK_SIZE))
+        if newline >= 0:
+            end = newline + 1
+        else:
+            end = min(length, pos + MAX_CHUNK_SIZE)
+            if end < length and isHighSurrogate(end - 1):
+                end -= 1 # keep a surrogate pair together
+        yield pos, end
+        pos = end
+
+def textChunks(text):
+    """ the chunks of a unicode string, see chunkRanges """
+    ranges = chunkRanges(len(text), lambda start, end: text.find(u'\n', start, end),
+                         lambda pos: u'\ud800' <= text[pos] <= u'\udbff')
+    for start, end in ranges:
+        yield text[start:end]
+
+def lineCount(text):
+    """ lines of a text as pygments counts them, the last one doesn't need a line end """
+    return text.count('\n') + (not text.endswith('\n') and 1 or 0)
+
+class PasteRenderer(object):
+    """ highlights pastes as html pages. The page is written chunk by chunk, so its size doesn't
+        matter. Lexers are created once per language, the formatter and the stylesheet once.
+        Large chunks are highlighted in a worker process, so they don't hold the GIL against
+        the FCP threads """
+
+    def __init__(self, style='default', workerMinSize=WORKER_MIN_SIZE):
+        self.style = style
+        self.workerMinSize = workerMinSize
+        self.lexers = {}
+        self.htmlFormatter = None
+        self.styleDefs = None
+        self.compactStyleDefs = None
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def lexer(self, name):
+        with self.lock:
+            lexer = self.lexers.get(name)
+        if lexer is None:
+            from pygments.lexers import get_lexer_by_name
+            lexer = get_lexer_by_name(name, stripnl=False) # blank lines at the edge of a chunk are kept
+            with self.lock:
+                lexer = self.lexers.setdefault(name, lexer)
+        return lexer
+
+    def formatter(self):
+        """ the page around the tokens is written by renderTo, the formatter only marks them up """
+        if self.htmlFormatter is None:
+            from pygments.formatters import HtmlFormatter
+            self.htmlFormatter = HtmlFormatter(style=self.style, nowrap=True)
+        return self.htmlFormatter
+
+    def css(self, compact=False):
+        """ the stylesheet doesn't depend on the language or the line numbers """
+        if self.styleDefs is None:
+            self.styleDefs = self.formatter().get_style_defs('body')
+            self.compactStyleDefs = minifyCss(self.styleDefs)
+        return compact and self.compactStyleDefs or self.styleDefs
+
+    def highlight(self, text, lexerName, compact=False):
+        """ markup of a chunk of whole lines as utf-8 """
+        from pygments import highlight
+        formatter = self.formatter()
+        markup = highlight(text, self.lexer(lexerName), formatter)
+        if not text.endswith('\n') and markup.endswith('\n'):
+            markup = markup[:-1] # added by the lexer, the line goes on in the next chunk
+        if compact:
+            markup = compactSpans(markup, formatter.class2style)
+        return markup.encode('utf-8')
+
+    def highlightChunk(self, text, lexerName, compact=False):
+        """ like highlight, large chunks are highlighted in the worker process if it can be started """
+        if len(text) >= self.workerMinSize:
+            pool = self.workerPool()
+            if pool is not None:
+                try:
+                    return pool.apply_async(highlightInWorker, (self.style, text, lexerName, compact)).get(WORKER_TIMEOUT)
+                except Exception, e:
+                    pass # highlight it here, an unknown lexer raises again
+        return self.highlight(text, lexerName, compact)
+
+    def renderTo(self, out, chunks, lexerName, lines, linenos=False, title=u'', compact=False, stylesheet=None):
+        """ writes the page as utf-8 to out. chunks are unicode strings which end at a line end
+            unless the line is longer than MAX_CHUNK_SIZE, lines is the number of lines of all of them. A compact page has no whitespace outside
+            of the paste, it links to the stylesheet's key if there is one, otherwise it embeds
+            the minified css """
+        if not compact:
+            head, tail = PAGE_HEAD % {'title':title, 'css':self.css()}, PAGE_TAIL
+        elif stylesheet:
+            head, tail = COMPACT_HEAD % {'title':title, 'style':u'<link rel="stylesheet" type="text/css" href="/%s">' % stylesheet}, COMPACT_TAIL
+        else:
+            head, tail = COMPACT_HEAD % {'title':title, 'style':u'<style type="text/css">%s</style>' % self.css(compact=True)}, COMPACT_TAIL
+        out.write(head.encode('utf-8'))
+        if linenos:
+            self.writeLineNumbers(out, lines)
+        out.write('<div class="highlight"><pre>')
+        for chunk in chunks:
+            out.write(self.highlightChunk(chunk, lexerName, compact))
+        out.write('</pre></div>')
+        if linenos:
+            out.write('</td></tr></table>')
+        out.write(tail.encode('utf-8'))
+
+    def writeLineNumbers(self, out, lines):
+        """ the line numbers column in front of the code, as pygments' table line numbers """
+        width = len(str(lines))
+        out.write('<table class="highlighttable"><tr><td class="linenos"><div class="linenodiv"><pre>')
+        for start in xrange(1, lines+1, LINENOS_BATCH):
+            if start > 1:
+                out.write('\n')
+            out.write('\n'.join(['%*d' % (width, line) for line in xrange(start, min(start+LINENOS_BATCH, lines+1))]))
+        out.write('</pre></div></td><td class="code">')
+
+    def renderPage(self, text, lexerName, linenos=False, title=u'', compact=False, stylesheet=None):
+        """ returns the page of a short text as utf-8 """
+        out = StringIO()
+        self.renderTo(out, [text], lexerName, lineCount(text), linenos, title, compact, stylesheet)
+        return out.getvalue()
+
+    def workerPool(self):
+        with self.lock:
+            if self.pool is None:
+                try:
+                    from multiprocessing import Pool
+                    self.pool = Pool(1)
+                except Exception, e:
+                    self.pool = False # no worker processes on this platform, don't try again
+            return self.pool or None
+
+    def close(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool:
+            pool.terminate()
+
+workerRenderers = {} # per style
+
+def highlightInWorker(style, *args):
+    """ runs in the worker process, which keeps its own caches """
+    if style not in workerRenderers:
+        workerRenderers[style] = PasteRenderer(style)
+    return workerRenderers[style].highlight(*args)
@@ -0,0 +1,70 @@
+import threading
+from ProgressTable import BLOCK_SIZE
+
+MIN_PRIORITY = 6 # FCP PriorityClass runs from 0 (maximum) to 6 (minimum)
+
+class PriorityPolicy(object):
+    """ picks the PriorityClass and realtime flag of a request from its size and the number
+        of running requests, configured by the [priorities] section of the settings.
+        Small items are sent realtime with a high priority, so they finish fast while bulk
+        uploads are running. Requests close to finishing are promoted by rebalance() """
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.assigned = {} # identifier -> PriorityClass of the running requests
+
+    def value(self, name):
+        return int(self.config[name])
+
+    def isSmall(self, size):
+        return size <= self.value('small_kb') * 1024
+
+    def forInsert(self, identifier, size, depth=0):
+        """ returns (PriorityClass, realtime) for an insert of size bytes, depth is the number of running requests """
+        if size and self.isSmall(size):
+            priority, realtime = self.value('small_insert'), self.config.as_bool('small_realtime')
+        elif size >= self.value('bulk_mb') * 1024 * 1024:
+            priority, realtime = self.value('bulk_insert'), False
+        else:
+            priority, realtime = self.value('insert'), False
+        if not realtime and depth > self.value('queue_depth'):
+            priority = min(priority + 1, MIN_PRIORITY) # make room for the next small items
+        self.assign(identifier, priority)
+        return priority, realtime
+
+    def forPaste(self):
+        return self.value('paste'), self.config.as_bool('paste_realtime')
+
+    def forDownload(self, identifier, count=1, depth=0):
+        """ priority of one of count downloads queued together """
+        priority = self.value('download')
+        if count + depth > self.value('queue_depth'):
+            priority = min(priority + 1, MIN_PRIORITY)
+        self.assign(identifier, priority)
+        return priority
+
+    def assign(self, identifier, priority):
+        with self.lock:
+            self.assigned[identifier] = priority
+
+    def release(self, identifier):
+        """ forget a finished request """
+        with self.lock:
+            self.assigned.pop(identifier, None)
+
+    def rebalance(self, requests):
+        """ takes the RequestProgress of the running requests, returns a list of (identifier, PriorityClass)
+            for the requests to change: those with only a small rest left get the priority of small inserts """
+        target = self.value('small_insert')
+        changes = []
+        with self.lock:
+            for request in requests:
+                priority = self.assigned.get(request.identifier)
+                if priority is None or priority <= target or not request.finalized:
+                    continue
+                left = request.total - request.succeeded - request.failed
+                if self.isSmall(left * BLOCK_SIZE):
+                    self.assigned[request.identifier] = target
+                    changes.append((request.identifier, target))
+        return changes
@@ -0,0 +1,149 @@
+import threading, time, heapq
+
+BLOCK_SIZE = 32*1024 # data bytes of a CHK block
+RATE_SMOOTHING = 0.3
+RATE_INTERVAL = 1.0 # seconds between two samples of a request's rate
+PREFIXES = ('Warren-', 'Warren:') # inserts and downloads of warren
+
+FINISHED_MESSAGES = frozenset(['PutSuccessful', 'DataFound'])
+FAILED_MESSAGES = frozenset(['PutFailed', 'GetFailed'])
+NEW_MESSAGES = frozenset(['PersistentPut', 'PersistentPutDir', 'PersistentGet', 'URIGenerated'])
+
+class RequestProgress(object):
+    """ progress of one request on the global queue, counted in blocks """
+
+    __slots__ = ('identifier', 'total', 'succeeded', 'failed', 'finalized', 'rate', 'updated', 'sampleTime', 'sampleBlocks')
+
+    def __init__(self, identifier):
+        self.identifier = identifier
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.finalized = False
+        self.rate = 0.0 # blocks per second
+        self.updated = time.time()
+        self.sampleTime = None
+        self.sampleBlocks = 0
+
+    def isUpload(self):
+        return self.identifier.startswith('Warren-')
+
+    def name(self):
+        return self.identifier[len('Warren-'):]
+
+    def eta(self):
+        """ seconds until finished, None if unknown """
+        if not self.rate or not self.finalized:
+            return None
+        return max(0, self.total - self.succeeded - self.failed) / self.rate
+
+class ProgressTable(object):
+    """ progress of warren's requests on the node's global queue, fed with the messages
+        of WatchGlobal. Only running requests are kept, the totals over all of them are
+        updated with every message, so the cost of a message doesn't depend on the number
+        of requests """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.uploads = 0
+        self.totalBlocks = 0
+        self.doneBlocks = 0
+        self.rate = 0.0
+        self.finished = 0
+        self.failed = 0
+
+    def message(self, message):
+        """ watcher callback, returns True if the table changed """
+        identifier = message.get('Identifier')
+        if not identifier or not identifier.startswith(PREFIXES):
+            return False
+        header = message['header']
+        with self.lock:
+            request = self.requests.get(identifier)
+            if header == 'SimpleProgress':
+                if request is None:
+                    request = self._add(identifier)
+                self._progress(request, message)
+            elif header in NEW_MESSAGES:
+                if request is not None:
+                    return False
+                self._add(identifier)
+            elif header in FINISHED_MESSAGES or header in FAILED_MESSAGES or header == 'PersistentRequestRemoved':
+                if request is None:
+                    return False
+                self._remove(request)
+                if header in FINISHED_MESSAGES:
+                    self.finished += 1
+                elif header in FAILED_MESSAGES:
+                    self.failed += 1
+            else:
+                return False
+        return True
+
+    def clear(self):
+        """ forget the running requests, e.g. after the connection to the node was lost """
+        with self.lock:
+            self.requests.clear()
+            self.uploads = 0
+            self.totalBlocks = 0
+            self.doneBlocks = 0
+            self.rate = 0.0
+
+    def running(self):
+        with self.lock:
+            return self.requests.values()
+
+    def depth(self):
+        return len(self.requests)
+
+    def summary(self, top=5):
+        """ returns (uploads, downloads, totals, latest) with totals a dict of the table's counters
+            and latest the top most recently updated RequestProgress """
+        with self.lock:
+            uploads = self.uploads
+            downloads = len(self.requests) - uploads
+            totals = {'doneBlocks':self.doneBlocks, 'totalBlocks':self.totalBlocks, 'rate':self.rate,
+                      'finished':self.finished, 'failed':self.failed}
+            latest = heapq.nlargest(top, self.requests.itervalues(), key=lambda request: request.updated)
+        return uploads, downloads, totals, latest
+
+    def _add(self, identifier):
+        request = self.requests[identifier] = RequestProgress(identifier)
+        if request.isUpload():
+            self.uploads += 1
+        return request
+
+    def _remove(self, request):
+        del self.requests[request.identifier]
+        if request.isUpload():
+            self.uploads -= 1
+        self.totalBlocks -= request.total
+        self.doneBlocks -= request.succeeded + request.failed
+        self.rate -= request.rate
+
+    def _progress(self, request, message):
+        try:
+            total = int(message.get('Total', 0))
+            succeeded = int(message.get('Succeeded', 0))
+            failed = int(message.get('Failed', 0)) + int(message.get('FatallyFailed', 0))
+        except ValueError, e:
+            return
+        now = time.time()
+        rate = request.rate
+        if request.sampleTime is None or succeeded < request.sampleBlocks:
+            request.sampleTime, request.sampleBlocks = now, succeeded
+        elif now - request.sampleTime >= RATE_INTERVAL:
+            current = (succeeded - request.sampleBlocks) / (now - request.sampleTime)
+            rate = rate and rate + RATE_SMOOTHING * (current - rate) or current
+            request.sampleTime, request.sampleBlocks = now, succeeded
+
+        self.totalBlocks += total - request.total
+        self.doneBlocks += succeeded + failed - request.succeeded - request.failed
+        self.rate += rate - request.rate
+        request.total = total
+        request.succeeded = succeeded
+        request.failed = failed
+        request.finalized = message.get('FinalizedTotal') == 'true'
+        request.rate = rate
+        request.updated = now
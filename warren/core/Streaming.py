@@ -0,0 +1,87 @@
+import tempfile, shutil
+import os.path
+
+CHUNK_SIZE = 64 * 1024 # bytes per read/send, this is all the payload memory an upload needs
+SPOOL_SIZE = 4 * 1024 * 1024 # sources of unknown length are spooled to disk above this size
+
+class StreamPayload(object):
+    """ payload for a direct upload which is read from a file-like
+        object and sent to the node in CHUNK_SIZE blocks """
+
+    def __init__(self, source, length):
+        self.source = source
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def sendTo(self, sock):
+        remaining = self.length
+        while remaining > 0:
+            chunk = self.source.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise IOError('payload source ended %d bytes early' % remaining)
+            sock.sendall(chunk)
+            remaining -= len(chunk)
+
+    def close(self):
+        self.source.close()
+
+class SpoolPayload(StreamPayload):
+    """ payload of a spool file which may be sent more than once, e.g. a CHK-only put before
+        the insert. The spool is rewound for each send and closed by its owner """
+
+    def sendTo(self, sock):
+        self.source.seek(0)
+        StreamPayload.sendTo(self, sock)
+
+    def close(self):
+        pass
+
+class FilePayload(StreamPayload):
+    """ payload of a local file which is only opened when it is sent """
+
+    def __init__(self, path):
+        StreamPayload.__init__(self, None, os.path.getsize(path))
+        self.path = path
+
+    def sendTo(self, sock):
+        self.source = open(self.path, 'rb')
+        StreamPayload.sendTo(self, sock)
+
+    def close(self):
+        if self.source:
+            self.source.close()
+
+class MultiPayload(StreamPayload):
+    """ payloads sent back to back, as the direct files of a ClientPutComplexDir """
+
+    def __init__(self, payloads):
+        StreamPayload.__init__(self, None, sum([len(p) for p in payloads]))
+        self.payloads = payloads
+
+    def sendTo(self, sock):
+        for payload in self.payloads:
+            try:
+                payload.sendTo(sock)
+            finally:
+                payload.close()
+
+    def close(self):
+        for payload in self.payloads:
+            payload.close()
+
+def openPayload(opener, url):
+    """ open url for streaming. If the length is not known in advance
+        (e.g. http without Content-Length) it is spooled to a temporary file first """
+    u = opener.open(url)
+    length = u.headers.get('content-length')
+    if length is not None:
+        return StreamPayload(u, int(length))
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    shutil.copyfileobj(u, spool, CHUNK_SIZE)
+    u.close()
+    length = spool.tell()
+    spool.seek(0)
+    return StreamPayload(spool, length)
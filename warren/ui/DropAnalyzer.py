@@ -0,0 +1,64 @@
+from PyQt4.QtCore import QThread, pyqtSignal
+from warren.core.FileManager import analyzeUrl, UrlAnalysis, localPath
+import urllib2, threading
+import os, time
+
+ANALYZE_CACHE_TTL = 60 # seconds a remote url's content type is cached
+ANALYZE_CACHE_SIZE = 256
+
+class DropAnalyzer(QThread):
+    """ runs analyzeUrl off the GUI thread. Results are cached by url
+        and modification time (local files) or for ANALYZE_CACHE_TTL (remote) """
+
+    analyzed = pyqtSignal(object)
+    cache = {}
+    cacheLock = threading.Lock()
+
+    def __init__(self, parent, urls, proxy=None):
+        QThread.__init__(self, parent)
+        self.urls = urls
+        self.proxy = proxy
+        self.canceled = False
+        self.analysis = UrlAnalysis()
+        self.finished.connect(self.deleteLater)
+
+    def cancel(self):
+        """ a running request is aborted, its connection is shut down """
+        self.canceled = True
+        self.analysis.cancel()
+
+    def run(self):
+        """ emits a list of (url, content-type), or False if one of the urls can't be inserted """
+        result = []
+        for url in self.urls:
+            if self.canceled:
+                return
+            fileinfo = self.analyze(url)
+            if not fileinfo:
+                result = False
+                break
+            result.append(fileinfo)
+        if not self.canceled:
+            self.analyzed.emit(result or False)
+
+    def analyze(self, url):
+        tmpReq = urllib2.Request(url)
+        if tmpReq.get_type() == 'file':
+            try:
+                version = os.stat(localPath(url)).st_mtime
+            except OSError, e:
+                return False
+        else:
+            version = int(time.time() / ANALYZE_CACHE_TTL)
+
+        with self.cacheLock:
+            result = self.cache.get((url, version))
+        if result is None:
+            result = analyzeUrl(url, self.proxy, self.analysis)
+            if self.canceled:
+                return False # not cached, the url wasn't analyzed to the end
+            with self.cacheLock:
+                if len(self.cache) >= ANALYZE_CACHE_SIZE:
+                    self.cache.clear()
+                self.cache[(url, version)] = result
+        return result
@@ -1,7 +1,7 @@
-from PyQt4.QtGui import QWidget, QLabel, QHBoxLayout, QMenu, qApp, QPixmap, QFrame, QClipboard, QContextMenuEvent, QIcon, QApplication
-from PyQt4.QtCore import Qt, SIGNAL
-from warren.core import Config, NodeManager, FileManager, Browser
-from warren.ui import Settings, Pastebin, DropZone, Clipboard
+from PyQt4.QtGui import QWidget, QLabel, QHBoxLayout, QMenu, qApp, QPixmap, QFrame, QClipboard, QContextMenuEvent, QIcon, QApplication, QFileDialog, QMessageBox
+from PyQt4.QtCore import Qt, SIGNAL, QTimer
+from warren.core import Config, NodeManager, FileManager, Browser, ProgressTable
+from warren.ui import Settings, Pastebin, DropZone, Clipboard, DropAnalyzer
 import sys, os
 
 def determine_path ():
@@ -13,8 +13,15 @@ def determine_path ():
             root = os.path.realpath (root)
         return os.path.dirname (os.path.abspath (root))+'/../images/'
 
+def formatDuration(seconds):
+    if seconds < 60:
+        return '%d s' % seconds
+    if seconds < 3600:
+        return '%d min' % (seconds / 60)
+    return '%d h %d min' % (seconds / 3600, seconds % 3600 / 60)
+
 class MainWindow(QWidget):
-    def __init__(self):
+    def __init__(self, started=None):
         super(QWidget, self).__init__()
 
         self.setWindowFlags(Qt.FramelessWindowHint)
@@ -41,28 +48,42 @@ class MainWindow(QWidget):
         self.clipboard = Clipboard.Clipboard(self)
         self.clipboard.clipboardKey.connect(self.clipboardNewKey)
         self.clipboardKeys = list()
+        self.copiedKeys = list() # all keys of the last copied text, e.g. a list of keys
         self.clipboardKey = None
 
         self.nodeManagerConnected = False
-        self.dropData = {'accepted' : False, 'url' : None, 'content-type' : None}
+        self.resetDropData()
+        self.dropAnalyzer = None
 
         self.config = Config.Config()
-        self.settings = Settings.Settings(self.config)
-        self.pastebin = Pastebin.Pastebin(self)
+        self.settings = None # dialogs are created when they are opened the first time
+        self.pastebin = None
         self.nodeManager = NodeManager.NodeManager(self.config)
         self.setKeepOnTop(self.config['warren'].as_bool('start_on_top'))
         self.connect(self.nodeManager, SIGNAL("nodeConnected()"), self.nodeConnected)
-        self.connect(self.nodeManager, SIGNAL("nodeConnected()"), self.pastebin.nodeConnected)
         self.connect(self.nodeManager, SIGNAL("nodeConnectionLost()"), self.nodeNotConnected)
-        self.connect(self.nodeManager, SIGNAL("nodeConnectionLost()"), self.pastebin.nodeNotConnected)
-        self.connect(self.nodeManager, SIGNAL("pasteCanceledMessage()"), self.pastebin.reject)
-        self.connect(self.pastebin, SIGNAL("newPaste(QString, QString, QString)"), self.nodeManager.newPaste)
-        self.connect(self.nodeManager, SIGNAL("pasteFinished()"), self.pastebin.reject)
+        self.nodeManager.queueProgress.connect(self.showQueueProgress)
+        self.nodeManager.start() # connects the node
 
         self.browser = Browser.Browser(self.config)
 
         self.positionWindow()
         self.show()
+        if started:
+            QTimer.singleShot(0, lambda: self.nodeManager.metrics.since('warren_startup_seconds', started))
+
+    def showSettings(self):
+        if self.settings is None:
+            self.settings = Settings.Settings(self.config)
+        self.settings.show()
+
+    def showPastebin(self):
+        if self.pastebin is None:
+            self.pastebin = Pastebin.Pastebin(self)
+            self.connect(self.nodeManager, SIGNAL("pasteCanceledMessage()"), self.pastebin.reject)
+            self.connect(self.pastebin, SIGNAL("newPaste(QString, QString, QString)"), self.nodeManager.newPaste)
+            self.connect(self.nodeManager, SIGNAL("pasteFinished()"), self.pastebin.reject)
+        self.pastebin.show()
 
     def positionWindow(self):
         desktop = QApplication.desktop()
@@ -93,6 +114,13 @@ class MainWindow(QWidget):
                 receiver = lambda taskType=idx:self.dlAction(taskType)
                 self.connect(mItem, SIGNAL('triggered()'), receiver)
                 downloadMenu.addAction(mItem)
+            if len(self.clipboardKeys)>1:
+                downloadMenu.addSeparator()
+                allItem = downloadMenu.addAction('All of them')
+                self.connect(allItem, SIGNAL('triggered()'), self.dlAllAction)
+            if len(self.copiedKeys)>1:
+                copiedItem = downloadMenu.addAction('All %d keys last copied' % len(self.copiedKeys))
+                self.connect(copiedItem, SIGNAL('triggered()'), self.dlCopiedAction)
             menu.addMenu(downloadMenu)
 
             browserMenu = QMenu('Open in Browser', self)
@@ -105,6 +133,8 @@ class MainWindow(QWidget):
             menu.addMenu(browserMenu)
 
 
+        dlFromFileAction = menu.addAction("Download keys from file...")
+
         menu.addSeparator()
         keepOnTopAction = menu.addAction(self.keepOnTopMenuText)
         settingsAction = menu.addAction("Settings")
@@ -114,9 +144,11 @@ class MainWindow(QWidget):
         if action == quitAction:
             self.closeApp()
         if action == settingsAction:
-            self.settings.show()
+            self.showSettings()
         if action == pastebinAction:
-            self.pastebin.show()
+            self.showPastebin()
+        if action == dlFromFileAction:
+            self.dlFromFile()
         if action == keepOnTopAction:
             if self.keepOnTop:
                 self.setKeepOnTop(False)
@@ -140,7 +172,34 @@ class MainWindow(QWidget):
         # put last active key to top of list
         tmp = self.clipboardKeys.pop(menuIdx)
         self.clipboardKeys.insert(0,tmp)
-        self.nodeManager.putKeyOnQueue(key[0]+'@'+key[1])
+        self.queueDownloads([key[0]+'@'+key[1]])
+
+    def dlAllAction(self):
+        self.queueDownloads([key[0]+'@'+key[1] for key in self.clipboardKeys])
+
+    def dlCopiedAction(self):
+        self.queueDownloads([key[0]+'@'+key[1] for key in self.copiedKeys])
+
+    def dlFromFile(self):
+        filename = QFileDialog.getOpenFileName(self, 'Download keys from file')
+        if not filename:
+            return
+        try:
+            with open(unicode(filename), 'r') as f:
+                keys = Clipboard.KEY_PATTERN.findall(f.read())
+        except IOError, e:
+            QMessageBox.warning(self, 'Download keys from file', str(e))
+            return
+        if not keys:
+            QMessageBox.information(self, 'Download keys from file', 'No Freenet keys found in this file.')
+            return
+        self.queueDownloads([key[0]+'@'+key[1] for key in keys])
+
+    def queueDownloads(self, keys):
+        results = self.nodeManager.putKeysOnQueue(keys)
+        failed = ['%s: %s' % (key, error) for key, error in results if error]
+        if failed:
+            QMessageBox.warning(self, 'Download queue', '%d of %d keys could not be queued:\n\n%s' % (len(failed), len(results), '\n'.join(failed[:20])))
 
     def brAction(self,menuIdx):
 
@@ -153,6 +212,7 @@ class MainWindow(QWidget):
 
 
     def clipboardNewKey(self,keys):
+        self.copiedKeys = keys
         for key in keys:
             if key not in self.clipboardKeys:
                 if len(self.clipboardKeys) >= self.config['warren']['max_clipboard_keys']:
@@ -161,30 +221,59 @@ class MainWindow(QWidget):
 
     def enterEvent(self, mimeData = None):
         if not mimeData or not hasattr(mimeData, 'formats'): return
+        self.resetDropData() # DropZone sends no leave event after a drop
 
         if self.nodeManagerConnected:
 
             self.dropZone.setPixmap(QPixmap(self.imagePath+'dropzone_analyze.png'))
-            fileinfo = FileManager.checkFileForInsert(mimeData, proxy=self.config['proxy']['http']) # TODO: this is still blocking
-
-            if fileinfo:
-                self.dropZone.setPixmap(QPixmap(self.imagePath+'dropzone_ok.png'))
-                self.dropData['accepted'] = True
-                self.dropData['url'] = fileinfo[0]
-                self.dropData['content-type'] = fileinfo[1]
+            self.cancelDropAnalysis()
+            self.dropAnalyzer = DropAnalyzer.DropAnalyzer(self, FileManager.dropUrls(mimeData), proxy=self.config['proxy']['http'])
+            self.dropAnalyzer.analyzed.connect(self.dropAnalyzed)
+            self.dropAnalyzer.start()
+
+    def resetDropData(self):
+        self.dropData = {'accepted' : False, 'dropped' : False, 'items' : None}
+
+    def cancelDropAnalysis(self):
+        if self.dropAnalyzer:
+            self.dropAnalyzer.cancel()
+            self.dropAnalyzer = None
+
+    def dropAnalyzed(self, fileinfo):
+        if self.sender() is not self.dropAnalyzer: return # outdated result
+        self.dropAnalyzer = None
+
+        if fileinfo:
+            self.dropData['accepted'] = True
+            self.dropData['items'] = fileinfo
+            if self.dropData['dropped']: # dropped before analysis was finished
+                self.nodeManager.insertFiles(self.dropData['items'])
+                self.dropZone.setPixmap(QPixmap(self.imagePath+'dropzone.png'))
+                self.resetDropData()
             else:
-                self.dropZone.setPixmap(QPixmap(self.imagePath+'dropzone_rejected.png'))
+                self.dropZone.setPixmap(QPixmap(self.imagePath+'dropzone_ok.png'))
+        elif self.dropData['dropped']:
+            self.dropZone.setPixmap(QPixmap(self.imagePath+'dropzone.png'))
+            self.resetDropData()
+        else:
+            self.dropZone.setPixmap(QPixmap(self.imagePath+'dropzone_rejected.png'))
 
     def dropEvent(self, mimeData = None):
 
         if not mimeData or not hasattr(mimeData, 'formats') or not self.nodeManagerConnected:
             if self.nodeManagerConnected:
                 self.dropZone.setPixmap(QPixmap(self.imagePath+'dropzone.png')) # because it's leave event, too (mimeData=None)
-            self.dropData = {'accepted' : False, 'url' : None, 'content-type' : None}
+            self.cancelDropAnalysis()
+            self.resetDropData()
+            return
+
+        if self.dropAnalyzer:
+            self.dropData['dropped'] = True # insert as soon as the analysis is finished
             return
 
         if self.dropData['accepted']:
-            self.nodeManager.insertFile(self.dropData['url'], self.dropData['content-type'])
+            self.nodeManager.insertFiles(self.dropData['items'])
+        self.resetDropData()
 
         self.dropZone.setPixmap(QPixmap(self.imagePath+'dropzone.png'))
 
@@ -202,10 +291,39 @@ class MainWindow(QWidget):
     def nodeConnected(self):
         self.nodeManagerConnected = True
         self.dropZone.setPixmap(QPixmap(self.imagePath+'dropzone.png'))
+        if self.pastebin:
+            self.pastebin.nodeConnected()
 
     def nodeNotConnected(self):
         self.nodeManagerConnected = False
         self.dropZone.setPixmap(QPixmap(self.imagePath+'dropzone_nocon.png'))
+        self.dropZone.setToolTip('')
+        if self.pastebin:
+            self.pastebin.nodeNotConnected()
+
+    def showQueueProgress(self, summary):
+        """ progress of warren's requests on the global queue as tooltip of the drop zone """
+        uploads, downloads, totals, latest = summary
+        lines = ['%d uploads, %d downloads running' % (uploads, downloads)]
+        if totals['totalBlocks']:
+            line = '%d%% of %d blocks' % (100 * totals['doneBlocks'] / totals['totalBlocks'], totals['totalBlocks'])
+            if totals['rate']:
+                left = (totals['totalBlocks'] - totals['doneBlocks']) / totals['rate']
+                line += ', %d KiB/s, about %s left' % (totals['rate'] * ProgressTable.BLOCK_SIZE / 1024, formatDuration(left))
+            lines.append(line)
+        if totals['finished'] or totals['failed']:
+            lines.append('%d finished, %d failed' % (totals['finished'], totals['failed']))
+        if latest:
+            lines.append('')
+        for request in latest:
+            line = '%s %s' % (request.isUpload() and 'Up' or 'Down', request.name())
+            if request.total:
+                line += ': %d%%' % (100 * (request.succeeded + request.failed) / request.total)
+            eta = request.eta()
+            if eta is not None:
+                line += ', %s left' % formatDuration(eta)
+            lines.append(line)
+        self.dropZone.setToolTip('\n'.join(lines))
 
 
     def closeApp(self):
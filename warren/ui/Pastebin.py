@@ -1,37 +1,53 @@
 from PyQt4.QtGui import QDialog
 from PyQt4 import QtCore
 from PastebinDialog import Ui_PastebinDialog
-from pygments import lexers
+from warren.core.LexerCatalogue import LexerCatalogue
+import os.path
 
 class Pastebin(QDialog):
+    """ created when it's opened the first time, the lexer list comes from the LexerCatalogue """
 
     def __init__(self, parent):
         QDialog.__init__(self, parent)
         self.ui = Ui_PastebinDialog()
         self.ui.setupUi(self)
         self.parent = parent
+        self.catalogue = LexerCatalogue(os.path.join(parent.config.configDir, 'lexers'))
         QtCore.QObject.connect(self.ui.buttonBox, QtCore.SIGNAL("rejected()"), self.reject)
         QtCore.QObject.connect(self.ui.buttonBox, QtCore.SIGNAL("accepted()"), self.accept)
         self.buildLexersList()
-        self.nodeNotConnected()
+        if parent.nodeManagerConnected:
+            self.nodeConnected()
+        else:
+            self.nodeNotConnected()
 
     def buildLexersList(self):
-        l = lexers.get_all_lexers()
-        l = list(l)
-        l.sort()
-
-        for idx, lexer in enumerate(l):
-            if lexer[1][0] == 'text': textIdx = idx
-            self.ui.shl_select.addItem(lexer[0],lexer[1][0])
-
-        self.ui.shl_select.setCurrentIndex(textIdx)
+        """ guessing the language first, then the recently used lexers. The last used one is selected """
+        select = self.ui.shl_select
+        select.addItem('Guess from content', 'auto') # guessed by the paste insert, see LanguageGuess
+        select.insertSeparator(select.count())
+        recent = self.catalogue.recent()
+        for name, alias in recent:
+            select.addItem(name, alias)
+        if recent:
+            select.insertSeparator(select.count())
+
+        textIdx = recent and 2 or 0
+        for name, alias in self.catalogue.lexers():
+            if alias == 'text' and not recent: textIdx = select.count()
+            select.addItem(name, alias)
+
+        if self.catalogue.lastUsed() == 'auto':
+            textIdx = 0
+        select.setCurrentIndex(textIdx)
 
     def accept(self):
         qPaste = QtCore.QString(self.ui.plainTextEdit.document().toPlainText())
 
         lexIdx = self.ui.shl_select.currentIndex()
         lexer = self.ui.shl_select.itemData(lexIdx)
-        lexer = lexer.toString()
+        lexer = str(lexer.toString())
+        self.catalogue.used(lexer)
 
         lineNos = self.ui.linenos_checkbox.isChecked()
 